@@ -0,0 +1,367 @@
+"""Load test of the bot against a fake Nextcloud, the results are written as JSON
+
+The bot is started as a subprocess with a fresh database. Synthetic Talk webhooks of many rooms, text and activity
+messages, are posted at a target rate, then summaries of some rooms are requested and timed until the fake Talk
+receives them. Reported are the webhook throughput and latency, the rate messages were stored at, the end-to-end
+latency of summaries and the size of the database.
+
+    python benchmarks/bench.py --rooms 50 --messages 20000 --rate 1000 --summaries 10 --task-latency 2
+
+Bot settings are passed with ``--env``, like ``--env PROMPT_FORMAT=compact``.
+"""
+
+import argparse
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import random
+import re
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from fake_nextcloud import FakeNextcloud
+
+LIB_DIR = Path(__file__).resolve().parent.parent / "lib"
+APP_ID = "summary_bot"
+APP_SECRET = "benchmark"
+APP_VERSION = "0.0.0"
+BOT_SECRET = "benchmark-bot-secret"
+
+NAMES = ["Alice", "Bob", "Carol", "Dave", "Erin", "Frank", "Grace", "Heidi", "Ivan", "Judy", "Mallory", "Oscar"]
+WORDS = (
+    "the release build is failing again after we merged the new storage backend so please check the logs before"
+    " tomorrow meeting where we decide about deadline budget design review customer feedback and the next sprint"
+    " planning also lunch coffee migration database index query cache latency dashboard alert incident fix"
+).split()
+ACTIVITIES = [
+    ("{actor} added {user}", ("actor", "user")),
+    ("{actor} removed {user}", ("actor", "user")),
+    ("{actor} renamed the conversation", ("actor",)),
+    ("{file}", ()),
+    ("Someone voted on the poll {poll}", ()),
+]
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)$")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values: list[float], scale: float = 1) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, round(p * len(ordered) + 0.5) - 1))] * scale, 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * scale, 3),
+        "p50": rank(0.5),
+        "p90": rank(0.9),
+        "p99": rank(0.99),
+        "max": round(ordered[-1] * scale, 3),
+    }
+
+
+def scrape(bot_url: str) -> dict[str, float]:
+    """Metric samples of the bot summed over their labels, empty if ``/metrics`` is disabled"""
+    try:
+        with urllib.request.urlopen(bot_url + "/metrics", timeout=10) as response:
+            text = response.read().decode()
+    except OSError:
+        return {}
+    samples: dict[str, float] = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match and "le=" not in (match.group(2) or ""):
+            samples[match.group(1)] = samples.get(match.group(1), 0) + float(match.group(3))
+    return samples
+
+
+class Traffic:
+    """Synthetic Talk webhooks, the same seed gives the same messages"""
+
+    def __init__(self, rooms: int, activity_ratio: float, seed: int):
+        self.rooms = [(f"bench{index:05}", f"Benchmark room {index}") for index in range(rooms)]
+        self.activity_ratio = activity_ratio
+        self._random = random.Random(seed)
+        self._message_id = 0
+
+    def _envelope(self, kind: str, actor: str, room: tuple[str, str], name: str, content: dict) -> dict:
+        self._message_id += 1
+        return {
+            "type": kind,
+            "actor": {"type": "Person", "id": f"users/{actor.lower()}", "name": actor},
+            "object": {
+                "type": "Note",
+                "id": str(self._message_id),
+                "name": name,
+                "content": json.dumps(content),
+                "mediaType": "text/markdown",
+            },
+            "target": {"type": "Collection", "id": room[0], "name": room[1]},
+        }
+
+    def message(self) -> tuple[dict, bool]:
+        """A webhook payload and whether the bot stores it"""
+        room = self._random.choice(self.rooms)
+        actor = self._random.choice(NAMES)
+        if self._random.random() < self.activity_ratio:
+            template, keys = self._random.choice(ACTIVITIES)
+            parameters = {key: {"type": "user", "name": self._random.choice(NAMES)} for key in keys}
+            if template == "{file}":
+                parameters["file"] = {"type": "file", "name": f"report-{self._message_id}.pdf"}
+            content = {"message": template, "parameters": parameters}
+            return self._envelope("Activity", actor, room, "system", content), not template.startswith("Someone")
+        text = " ".join(self._random.choices(WORDS, k=self._random.randint(3, 40)))
+        return self._envelope("Create", actor, room, "message", {"message": text, "parameters": {}}), True
+
+    def command(self, room: tuple[str, str], text: str) -> dict:
+        return self._envelope("Create", "Alice", room, "message", {"message": text, "parameters": {}})
+
+
+class Sender:
+    """Posts webhooks like Talk does, one keep-alive connection per thread"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self._local = threading.local()
+
+    def post(self, payload: dict) -> tuple[int, float]:
+        """Status code (0 on a connection error) and seconds until the response"""
+        body = json.dumps(payload).encode()
+        random_value = secrets.token_hex(32)
+        signature = hmac.new(BOT_SECRET.encode(), random_value.encode() + body, hashlib.sha256).hexdigest()
+        headers = {
+            "Content-Type": "application/json",
+            "X-Nextcloud-Talk-Random": random_value,
+            "X-Nextcloud-Talk-Signature": signature,
+            "X-Nextcloud-Talk-Backend": "http://localhost/",
+        }
+        start = time.perf_counter()
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            try:
+                connection.request("POST", f"/{APP_ID}", body, headers)
+                response = connection.getresponse()
+                response.read()
+                return response.status, time.perf_counter() - start
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    return 0, time.perf_counter() - start
+        raise AssertionError("unreachable")
+
+
+def start_bot(port: int, nextcloud_url: str, storage: str, extra_env: dict[str, str], log) -> subprocess.Popen:
+    callback_url = APP_ID
+    env = dict(
+        os.environ,
+        APP_ID=APP_ID,
+        APP_DISPLAY_NAME="Summary Bot",
+        APP_SECRET=APP_SECRET,
+        APP_VERSION=APP_VERSION,
+        APP_HOST="127.0.0.1",
+        APP_PORT=str(port),
+        NEXTCLOUD_URL=nextcloud_url,
+        APP_PERSISTENT_STORAGE=storage,
+        **{hashlib.sha1(f"{APP_ID}_{callback_url}".encode()).hexdigest(): BOT_SECRET},  # noqa: S324
+    )
+    env.update(extra_env)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:APP", "--host", "127.0.0.1", "--port", str(port), "--log-level",
+         "warning"],
+        cwd=LIB_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def wait_until_ready(bot: subprocess.Popen, bot_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if bot.poll() is not None:
+            raise RuntimeError(f"The bot exited with code {bot.returncode}")
+        try:
+            with urllib.request.urlopen(bot_url + "/heartbeat", timeout=2):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("The bot did not start in time")
+
+
+def run_ingest(args, traffic: Traffic, sender: Sender) -> tuple[dict, int]:
+    payloads = [traffic.message() for _ in range(args.messages)]
+    statuses: dict[str, int] = {}
+    latencies: list[float] = []
+    lock = threading.Lock()
+    start = time.monotonic()
+
+    def send(index: int):
+        if args.rate > 0:
+            delay = start + index / args.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        status, seconds = sender.post(payloads[index][0])
+        with lock:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            latencies.append(seconds)
+        return status
+
+    with ThreadPoolExecutor(args.connections) as pool:
+        results = list(pool.map(send, range(len(payloads))))
+    send_seconds = time.monotonic() - start
+    expected = sum(1 for (_, stored), status in zip(payloads, results, strict=True) if stored and status == 200)
+    return {
+        "webhooks": len(payloads),
+        "statuses": statuses,
+        "send_seconds": round(send_seconds, 3),
+        "webhooks_per_second": round(len(payloads) / send_seconds, 1),
+        "webhook_latency_ms": percentiles(latencies, 1000),
+        "expected_stored": expected,
+    }, expected
+
+
+def wait_for_ingest(bot_url: str, expected: int, start: float, timeout: float) -> dict:
+    deadline = time.monotonic() + timeout
+    samples = scrape(bot_url)
+    if not samples:
+        return {"stored": None, "note": "metrics are disabled, the stored messages could not be counted"}
+    stored = 0
+    while time.monotonic() < deadline:
+        samples = scrape(bot_url)
+        stored = int(samples.get("summary_bot_ingest_messages_total", 0))
+        dropped = int(samples.get("summary_bot_ingest_dropped_total", 0))
+        if stored + dropped >= expected:
+            break
+        time.sleep(0.05)
+    seconds = time.monotonic() - start
+    return {
+        "stored": stored,
+        "dropped": int(samples.get("summary_bot_ingest_dropped_total", 0)),
+        "rejected": int(samples.get("summary_bot_ingest_rejected_total", 0)),
+        "ingest_seconds": round(seconds, 3),
+        "messages_per_second": round(stored / seconds, 1),
+    }
+
+
+def run_summaries(args, traffic: Traffic, sender: Sender, fake: FakeNextcloud) -> dict:
+    rooms = traffic.rooms[: args.summaries]
+    latencies: list[float] = []
+    failed = 0
+
+    def summarize(room: tuple[str, str]) -> float | None:
+        start = time.monotonic()
+        status, _ = sender.post(traffic.command(room, f"@summary {args.summary_duration}"))
+        if status != 200:
+            return None
+        posted = fake.wait_for_message(room[0], "**Summary:**", start, args.summary_timeout)
+        return None if posted is None else posted - start
+
+    with ThreadPoolExecutor(max(1, len(rooms))) as pool:
+        for latency in pool.map(summarize, rooms):
+            if latency is None:
+                failed += 1
+            else:
+                latencies.append(latency)
+    return {"requested": len(rooms), "failed": failed, "latency_seconds": percentiles(latencies)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--rooms", type=int, default=50, help="conversations the messages are spread over")
+    parser.add_argument("--messages", type=int, default=10000, help="webhooks to send")
+    parser.add_argument("--rate", type=float, default=500, help="webhooks per second, 0 sends as fast as possible")
+    parser.add_argument("--activity-ratio", type=float, default=0.1, help="share of activity messages")
+    parser.add_argument("--connections", type=int, default=16, help="webhooks sent at the same time")
+    parser.add_argument("--summaries", type=int, default=10, help="rooms to request a summary for at once")
+    parser.add_argument("--summary-duration", default="1d", help="duration of the requested summaries")
+    parser.add_argument("--summary-timeout", type=float, default=300, help="seconds to wait for one summary")
+    parser.add_argument("--task-latency", type=float, default=1.0, help="seconds a TaskProcessing task takes")
+    parser.add_argument("--no-task-webhook", action="store_true", help="let the bot poll for finished tasks")
+    parser.add_argument("--ingest-timeout", type=float, default=120, help="seconds to wait for messages to be stored")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic traffic")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="setting for the bot")
+    parser.add_argument("--output", help="file to write the JSON results to instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the data directory with the database and bot log")
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    storage = tempfile.mkdtemp(prefix="summary_bot_bench_")
+    port = free_port()
+    bot_url = f"http://127.0.0.1:{port}"
+    fake = FakeNextcloud(args.task_latency, bot_url, APP_ID, APP_SECRET, APP_VERSION, not args.no_task_webhook)
+    fake.start()
+    log_path = os.path.join(storage, "bot.log")
+    with open(log_path, "wb") as log:
+        bot = start_bot(port, fake.url, storage, extra_env, log)
+    try:
+        wait_until_ready(bot, bot_url)
+        traffic = Traffic(args.rooms, args.activity_ratio, args.seed)
+        sender = Sender(port)
+
+        start = time.monotonic()
+        ingest, expected = run_ingest(args, traffic, sender)
+        ingest.update(wait_for_ingest(bot_url, expected, start, args.ingest_timeout))
+        summaries = run_summaries(args, traffic, sender, fake)
+        samples = scrape(bot_url)
+        database_bytes = sum(path.stat().st_size for path in Path(storage).glob("*.db*"))
+    except Exception:
+        with open(log_path, encoding="utf-8", errors="replace") as log:
+            sys.stderr.write(log.read()[-5000:])
+        raise
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        fake.close()
+        if not args.keep:
+            shutil.rmtree(storage, ignore_errors=True)
+
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep")},
+        "ingest": ingest,
+        "summaries": summaries,
+        "tasks": {
+            "scheduled": fake.tasks_scheduled,
+            "polls": fake.task_polls,
+            "webhook_errors": fake.webhook_errors,
+            "finished": int(samples["summary_bot_tasks_total"]) if "summary_bot_tasks_total" in samples else None,
+        },
+        "database_bytes": database_bytes,
+        "data_directory": storage if args.keep else None,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+    return 0 if summaries["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""A stand-in for the parts of Nextcloud the bot talks to: OCS, TaskProcessing and the Talk bot API
+
+Tasks finish after a fixed latency with a short canned output, the bot is notified through the TaskProcessing webhook
+like AppAPI does. Messages the bot posts to Talk are recorded, so a benchmark can wait for them.
+"""
+
+import base64
+import json
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_TASK_PATH = re.compile(r"^/ocs/v2\.php/taskprocessing/task/(\d+)$")
+_BOT_MESSAGE_PATH = re.compile(r"^/ocs/v2\.php/apps/spreed/api/v1/bot/([^/]+)/message$")
+
+TASK_TYPES = {
+    "types": {
+        "core:text2text": {
+            "name": "Free text to text prompt",
+            "inputShapeDefaults": {},
+            "optionalInputShapeDefaults": {"max_tokens": 1000},
+        }
+    }
+}
+
+
+def _ocs(data, status: str = "ok", statuscode: int = 200) -> bytes:
+    meta = {"status": status, "statuscode": statuscode, "message": ""}
+    return json.dumps({"ocs": {"meta": meta, "data": data}}).encode()
+
+
+class FakeNextcloud:
+    """Serves the fake in a background thread, ``url`` is set once ``start`` returns.
+
+    :param task_latency: seconds from scheduling a task to its result
+    :param bot_url: base URL of the bot, used to call the TaskProcessing webhook
+    :param webhooks: call the webhook of a finished task, otherwise the bot has to poll
+    """
+
+    def __init__(
+        self,
+        task_latency: float,
+        bot_url: str,
+        app_id: str,
+        app_secret: str,
+        app_version: str,
+        webhooks: bool = True,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.task_latency = task_latency
+        self.bot_url = bot_url.rstrip("/")
+        self.webhooks = webhooks
+        self._app_headers = {
+            "EX-APP-ID": app_id,
+            "EX-APP-VERSION": app_version,
+            "AUTHORIZATION-APP-API": base64.b64encode(f":{app_secret}".encode()).decode(),
+            "Content-Type": "application/json",
+        }
+        self._lock = threading.Condition()
+        self._tasks: dict[int, dict] = {}
+        self._next_task_id = 1
+        self.task_polls = 0
+        self.webhook_errors = 0
+        self.messages: list[tuple[float, str, str]] = []
+        """Messages posted by the bot as ``(monotonic time, conversation token, message)``"""
+
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-nextcloud", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def tasks_scheduled(self) -> int:
+        with self._lock:
+            return len(self._tasks)
+
+    def wait_for_message(self, token: str, prefix: str, after: float, timeout: float) -> float | None:
+        """Monotonic time of the first message to ``token`` starting with ``prefix`` posted after ``after``"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                for posted, message_token, message in self.messages:
+                    if posted >= after and message_token == token and message.startswith(prefix):
+                        return posted
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._lock.wait(remaining)
+
+    def _schedule_task(self, payload: dict) -> dict:
+        now = int(time.time())
+        with self._lock:
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            task = {
+                "id": task_id,
+                "type": payload.get("type"),
+                "appId": payload.get("appId"),
+                "status": "STATUS_SCHEDULED",
+                "input": payload.get("input"),
+                "output": None,
+                "scheduledAt": now,
+                "startedAt": None,
+                "endedAt": None,
+            }
+            self._tasks[task_id] = task
+            result = dict(task)
+        timer = threading.Timer(self.task_latency, self._finish_task, (task_id, payload.get("webhookUri")))
+        timer.daemon = True
+        timer.start()
+        return result
+
+    def _finish_task(self, task_id: int, webhook_uri: str | None):
+        with self._lock:
+            task = self._tasks[task_id]
+            prompt = str((task["input"] or {}).get("input", ""))
+            task.update(
+                status="STATUS_SUCCESSFUL",
+                output={"output": f"- A summary of a prompt of {len(prompt)} characters"},
+                startedAt=task["scheduledAt"],
+                endedAt=int(time.time()),
+            )
+            task = dict(task)
+        if self.webhooks and webhook_uri:
+            request = urllib.request.Request(
+                self.bot_url + webhook_uri,
+                data=json.dumps({"task": task}).encode(),
+                headers=self._app_headers,
+                method="POST",
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    response.read()
+            except OSError:
+                with self._lock:
+                    self.webhook_errors += 1
+
+    def _get_task(self, task_id: int) -> dict | None:
+        with self._lock:
+            self.task_polls += 1
+            task = self._tasks.get(task_id)
+            return None if task is None else dict(task)
+
+    def _record_message(self, token: str, payload: dict):
+        with self._lock:
+            self.messages.append((time.monotonic(), token, str(payload.get("message", ""))))
+            self._lock.notify_all()
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        return type("Handler", (_Handler,), {"fake": self})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake: FakeNextcloud
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def _reply(self, body: bytes, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _payload(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return {}
+        return payload if isinstance(payload, dict) else {}
+
+    def do_GET(self):  # noqa: N802
+        path = self.path.split("?", 1)[0]
+        if path == "/ocs/v2.php/taskprocessing/tasktypes":
+            self._reply(_ocs(TASK_TYPES))
+            return
+        match = _TASK_PATH.match(path)
+        if match:
+            task = self.fake._get_task(int(match.group(1)))
+            if task is None:
+                self._reply(_ocs([], "failure", 404), 404)
+            else:
+                self._reply(_ocs({"task": task}))
+            return
+        self._reply(_ocs([]))
+
+    def do_POST(self):  # noqa: N802
+        path = self.path.split("?", 1)[0]
+        payload = self._payload()
+        if path == "/ocs/v2.php/taskprocessing/schedule":
+            self._reply(_ocs({"task": self.fake._schedule_task(payload)}))
+            return
+        match = _BOT_MESSAGE_PATH.match(path)
+        if match:
+            self.fake._record_message(match.group(1), payload)
+            self._reply(_ocs([], statuscode=201), 201)
+            return
+        self._reply(_ocs([]))
+
+    do_PUT = do_POST  # noqa: N815
+    do_DELETE = do_GET  # noqa: N815
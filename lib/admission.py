@@ -0,0 +1,247 @@
+"""Admission control for summaries requested by commands, so one busy conversation cannot starve the others"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "8"))
+"""Summaries requested by commands that are generated at the same time, further ones wait in a queue that serves the
+conversations in turn"""
+
+SUMMARY_MAX_QUEUED = int(os.environ.get("SUMMARY_MAX_QUEUED", "100"))
+"""Summaries that may wait in the queue, further requests are turned down"""
+
+SUMMARY_ROOM_PENDING = int(os.environ.get("SUMMARY_ROOM_PENDING", "2"))
+"""Summaries of one conversation that may be queued or running at the same time"""
+
+SUMMARY_ROOM_RATE_LIMIT = float(os.environ.get("SUMMARY_ROOM_RATE_LIMIT", "6"))
+"""Summaries one conversation may request per hour, 0 disables the limit"""
+
+SUMMARY_ROOM_RATE_BURST = int(os.environ.get("SUMMARY_ROOM_RATE_BURST", "3"))
+"""Summaries one conversation may request at once before ``SUMMARY_ROOM_RATE_LIMIT`` applies"""
+
+SUMMARY_RATE_LIMIT = float(os.environ.get("SUMMARY_RATE_LIMIT", "120"))
+"""Summaries all conversations together may request per hour, 0 disables the limit"""
+
+SUMMARY_RATE_BURST = int(os.environ.get("SUMMARY_RATE_BURST", "20"))
+"""Summaries that may be requested at once before ``SUMMARY_RATE_LIMIT`` applies"""
+
+SUMMARY_MAX_DAYS = float(os.environ.get("SUMMARY_MAX_DAYS", "31"))
+"""Longest time range a summary may cover in days, 0 disables the limit"""
+
+
+class AdmissionError(Exception):
+    """A summary request that is turned down, the message is shown to the user"""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class TokenBucket:
+    def __init__(self, rate_per_hour: float, burst: int):
+        self.rate = rate_per_hour / 3600
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available now"""
+        if self.rate <= 0:
+            return 0.0
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self._tokens -= 1
+
+    def full(self, now: float) -> bool:
+        return self.rate <= 0 or self._tokens + (now - self._updated) * self.rate >= self.burst
+
+
+class Ticket:
+    """An admitted summary, ``position`` is its place in the queue when it was admitted, 0 if it could start at once"""
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.position = 0
+        self.granted = False
+        self.released = False
+        self._future: asyncio.Future | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+
+class SummaryAdmission:
+    """Rate limits, caps and a fair queue in front of summary generation.
+
+    A request is checked against the duration cap, the pending summaries of its conversation, the size of the queue
+    and a per-conversation and a global token bucket. Admitted summaries beyond ``concurrency`` wait in one queue per
+    conversation and the queues are served in turn, so a conversation with many requests only delays its own.
+    ``admit`` and ``release`` may be called from any thread, ``wait`` is awaited on an event loop.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        max_queued: int,
+        room_pending: int,
+        room_rate: float,
+        room_burst: int,
+        rate: float,
+        burst: int,
+        max_days: float,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.max_queued = max_queued
+        self.room_pending = room_pending
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.max_seconds = max_days * 86400
+        self.running = 0
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(rate, burst)
+        self._room_buckets: dict[str, TokenBucket] = {}
+        self._pending: dict[str, int] = {}
+        self._queues: dict[str, deque[Ticket]] = {}
+        # conversations with queued summaries in the order they are served next
+        self._turns: deque[str] = deque()
+        self._queued = 0
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def admit(self, room_id: str, duration_seconds: float) -> Ticket:
+        """Admits a summary of a conversation, to be awaited with ``wait`` and handed back with ``release``
+
+        :raises AdmissionError: if the request is turned down
+        """
+        if self.max_seconds > 0 and duration_seconds > self.max_seconds:
+            raise AdmissionError(f"Summaries can cover at most the last {self.max_seconds / 86400:g} days", "duration")
+        now = time.monotonic()
+        with self._lock:
+            pending = self._pending.get(room_id, 0)
+            if self.room_pending > 0 and pending >= self.room_pending:
+                raise AdmissionError(
+                    f"This conversation already has {pending} summaries in progress, please wait until they are"
+                    " posted",
+                    "room_pending",
+                )
+            must_queue = self.running >= self.concurrency or self._queued > 0
+            if must_queue and self._queued >= self.max_queued:
+                raise AdmissionError("Too many summaries are waiting right now, please try again later", "queue_full")
+            room_bucket = self._room_buckets.get(room_id) or TokenBucket(self.room_rate, self.room_burst)
+            wait = max(self._bucket.wait_time(now), room_bucket.wait_time(now))
+            if wait > 0:
+                minutes = math.ceil(wait / 60)
+                raise AdmissionError(
+                    f"Rate limited, please try again in {minutes} minute{'' if minutes == 1 else 's'}", "rate_limited"
+                )
+            self._bucket.take()
+            room_bucket.take()
+            self._room_buckets[room_id] = room_bucket
+            self._forget_full_buckets(now)
+            self._pending[room_id] = pending + 1
+
+            ticket = Ticket(room_id)
+            if not must_queue:
+                ticket.granted = True
+                self.running += 1
+                return ticket
+            queue = self._queues.setdefault(room_id, deque())
+            ticket.position = self._position(room_id, len(queue))
+            queue.append(ticket)
+            if len(queue) == 1:
+                self._turns.append(room_id)
+            self._queued += 1
+            return ticket
+
+    def _position(self, room_id: str, index: int) -> int:
+        # served in rounds of one summary per conversation, the new one is in round ``index`` of its conversation
+        ahead = index
+        before = True
+        for other in self._turns:
+            if other == room_id:
+                before = False
+                continue
+            waiting = len(self._queues[other])
+            ahead += min(waiting, index) + (1 if before and waiting > index else 0)
+        return ahead + 1
+
+    def _forget_full_buckets(self, now: float):
+        # a full bucket is the same as a new one, so idle conversations take no memory
+        if len(self._room_buckets) > 1000:
+            for room_id in [room for room, bucket in self._room_buckets.items() if bucket.full(now)]:
+                del self._room_buckets[room_id]
+
+    async def wait(self, ticket: Ticket):
+        """Returns once the summary may be generated"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if ticket.granted:
+                return
+            ticket._future = loop.create_future()
+            ticket._loop = loop
+        await ticket._future
+
+    def release(self, ticket: Ticket):
+        """Hands back the place of a finished or abandoned summary and starts the next ones in turn"""
+        started = []
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            pending = self._pending.get(ticket.room_id, 1) - 1
+            if pending > 0:
+                self._pending[ticket.room_id] = pending
+            else:
+                self._pending.pop(ticket.room_id, None)
+            if ticket.granted:
+                self.running -= 1
+            else:
+                queue = self._queues[ticket.room_id]
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[ticket.room_id]
+                    self._turns.remove(ticket.room_id)
+
+            while self._turns and self.running < self.concurrency:
+                room_id = self._turns.popleft()
+                queue = self._queues[room_id]
+                next_ticket = queue.popleft()
+                if queue:
+                    self._turns.append(room_id)
+                else:
+                    del self._queues[room_id]
+                self._queued -= 1
+                next_ticket.granted = True
+                self.running += 1
+                started.append(next_ticket)
+
+        for next_ticket in started:
+            if next_ticket._future is not None:
+                next_ticket._loop.call_soon_threadsafe(_grant, next_ticket._future)
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+SUMMARY_ADMISSION = SummaryAdmission(
+    SUMMARY_CONCURRENCY,
+    SUMMARY_MAX_QUEUED,
+    SUMMARY_ROOM_PENDING,
+    SUMMARY_ROOM_RATE_LIMIT,
+    SUMMARY_ROOM_RATE_BURST,
+    SUMMARY_RATE_LIMIT,
+    SUMMARY_RATE_BURST,
+    SUMMARY_MAX_DAYS,
+)
+"""Admission of summaries requested by commands, scheduled summaries are only paced by the task limiter"""
@@ -0,0 +1,145 @@
+"""Serialisation of chat messages for prompts"""
+
+import os
+
+import tokens
+
+PROMPT_FORMAT = os.environ.get("PROMPT_FORMAT", "xml").lower()
+"""``xml`` wraps every message in tags, ``compact`` writes a legend of participants and one line per message, which
+fits more messages into the same context window"""
+
+
+def format_message(timestamp, actor: str, content: str) -> str:
+    return f"<msg><ts>{timestamp}</ts><at>{actor}</at><cnt>{content}</cnt></msg>"
+
+
+class ChatLog:
+    """Consecutive messages of one prompt, added newest first and written out oldest first.
+
+    ``length`` is the number of tokens of the written out log, ``cost`` tells how much a message would add to it.
+    """
+
+    DESCRIPTION = ""
+    """Explains the format to the model"""
+
+    MESSAGE_OVERHEAD = 0
+    """Characters every message adds to its actor and content, at most"""
+
+    def __init__(self):
+        self.length = 0
+        self.first_ts = ""
+        self.last_ts = ""
+        self._rows: list[tuple[str, str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def cost(self, timestamp, actor: str, content: str) -> int:
+        raise NotImplementedError
+
+    def add(self, timestamp, actor: str, content: str, cost: int):
+        self._rows.append((str(timestamp), actor, content))
+        self.length += cost
+        self.first_ts = str(timestamp)
+        if not self.last_ts:
+            self.last_ts = str(timestamp)
+
+    def text(self) -> str:
+        raise NotImplementedError
+
+
+class XmlChatLog(ChatLog):
+    DESCRIPTION = """The chat log will be provided to you below will be defined in an XML format inside triple single quotes.
+Each message will be encapsulated in a <msg> tag, with the following subtags:
+<ts> for the timestamp of the message
+<at> for the name of the participant
+<cnt> for the message content"""  # noqa: E501
+
+    MESSAGE_OVERHEAD = len(format_message("0000-00-00 00:00:00", "", "")) + 1
+
+    def cost(self, timestamp, actor: str, content: str) -> int:
+        # one more for the line break
+        return tokens.count(format_message(timestamp, actor, content)) + 1
+
+    def text(self) -> str:
+        return "\n".join(format_message(*row) for row in reversed(self._rows))
+
+
+class CompactChatLog(ChatLog):
+    """Chat log that spends fewer tokens on every message than the XML format.
+
+    Participants are replaced by short aliases, the date is written once per day and messages of a participant sent
+    within the same minute are merged into one.
+    """
+
+    DESCRIPTION = """The chat log will be provided to you below inside triple single quotes, the oldest message first.
+It starts with a legend that maps short aliases to the names of the participants, like "A = Alice".
+A line with only a date in square brackets starts the messages of that day.
+Each message starts with its time (HH:MM) and the alias of the participant, followed by the message content.
+Lines indented by two spaces continue the message above, they were sent by the same participant in the same minute."""  # noqa: E501
+
+    MESSAGE_OVERHEAD = len("00:00 A: ") + 1
+
+    def __init__(self):
+        super().__init__()
+        self._aliases: dict[str, str] = {}
+        self._days: set[str] = set()
+
+    @staticmethod
+    def _alias(index: int) -> str:
+        alias = ""
+        index += 1
+        while index:
+            index, rest = divmod(index - 1, 26)
+            alias = chr(ord("A") + rest) + alias
+        return alias
+
+    @staticmethod
+    def _body(content: str) -> str:
+        return content.replace("\n", "\n  ")
+
+    def _joins_newer(self, timestamp: str, actor: str) -> bool:
+        # the newer message becomes a continuation of this one
+        return bool(self._rows) and self._rows[-1][1] == actor and self._rows[-1][0][:16] == timestamp[:16]
+
+    def cost(self, timestamp, actor: str, content: str) -> int:
+        timestamp = str(timestamp)
+        cost = tokens.count(f"  {self._body(content)}") + 1
+        if actor not in self._aliases:
+            cost += tokens.count(f"{self._alias(len(self._aliases))} = {actor}") + 1
+        if timestamp[:10] not in self._days:
+            cost += tokens.count(f"[{timestamp[:10]}]") + 1
+        if not self._joins_newer(timestamp, actor):
+            # the head line of a group of merged messages
+            alias = self._aliases.get(actor) or self._alias(len(self._aliases))
+            cost += tokens.count(f"{timestamp[11:16]} {alias}:")
+        return cost
+
+    def add(self, timestamp, actor: str, content: str, cost: int):
+        if actor not in self._aliases:
+            self._aliases[actor] = self._alias(len(self._aliases))
+        self._days.add(str(timestamp)[:10])
+        super().add(timestamp, actor, content, cost)
+
+    def text(self) -> str:
+        legend = sorted(self._aliases.items(), key=lambda item: (len(item[1]), item[1]))
+        lines = [f"{alias} = {actor}" for actor, alias in legend]
+        previous = None
+        for timestamp, actor, content in reversed(self._rows):
+            if previous is None or previous[0][:10] != timestamp[:10]:
+                lines.append(f"[{timestamp[:10]}]")
+            if previous is not None and previous[1] == actor and previous[0][:16] == timestamp[:16]:
+                lines.append(f"  {self._body(content)}")
+            else:
+                lines.append(f"{timestamp[11:16]} {self._aliases[actor]}: {self._body(content)}")
+            previous = (timestamp, actor)
+        return "\n".join(lines)
+
+
+CHAT_LOG_FORMATS: dict[str, type[ChatLog]] = {"xml": XmlChatLog, "compact": CompactChatLog}
+
+if PROMPT_FORMAT not in CHAT_LOG_FORMATS:
+    raise ValueError(f"Unknown PROMPT_FORMAT {PROMPT_FORMAT!r}, use one of: {', '.join(CHAT_LOG_FORMATS)}")
+
+ChatLogFormat = CHAT_LOG_FORMATS[PROMPT_FORMAT]
+"""The chat log class selected by ``PROMPT_FORMAT``"""
@@ -0,0 +1,80 @@
+"""Scheduled summaries of rooms that are due at about the same time, small rooms are summarized together in one task"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from metrics import DIGEST_ROOMS, SUMMARY_SECONDS
+from pacing import PRIORITY, SCHEDULED
+from summarize import summarize_digests
+from taskproc import TASK_TRACKER
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+SCHEDULE_BATCH = os.environ.get("SCHEDULE_BATCH", "1").lower() not in ("0", "false", "no", "off")
+"""Summarize the chat logs of small rooms whose scheduled summaries are due together in one task"""
+
+SCHEDULE_BATCH_WINDOW = float(os.environ.get("SCHEDULE_BATCH_WINDOW", "60"))
+"""Seconds scheduled summaries are collected before the small rooms among them are summarized together"""
+
+SCHEDULE_BATCH_ROOMS = int(os.environ.get("SCHEDULE_BATCH_ROOMS", "8"))
+"""Rooms summarized in one task at most, they share the output tokens of the task"""
+
+Deliver = Callable[[str, str, str | None], None]
+"""Called in a worker thread with ``room_id``, ``room_name`` and the summary of the room, None if the room has to be
+summarized on its own"""
+
+
+class DigestBatcher:
+    """Collects the rooms of scheduled summaries for ``window`` seconds and summarizes the small ones together.
+
+    The collected rooms are handed to ``deliver`` once the batch is done, with their summary or None for rooms that
+    were too long to share a prompt, were left out by the model or whose batch failed.
+    """
+
+    def __init__(self, window: float, max_rooms: int, deliver: Deliver):
+        self.window = window
+        self.max_rooms = max(2, max_rooms)
+        self.deliver = deliver
+        self._lock = threading.Lock()
+        self._rooms: dict[str, str] = {}
+
+    def submit(self, room_id: str, room_name: str):
+        """Adds a room to the next batch, may be called from any thread"""
+        with self._lock:
+            first = not self._rooms
+            self._rooms[room_id] = room_name
+        if first:
+            TASK_TRACKER.spawn(self._run())
+
+    async def _run(self):
+        await asyncio.sleep(self.window)
+        with self._lock:
+            rooms, self._rooms = list(self._rooms.items()), {}
+        # inherited by all tasks of the batch, the task limiter serves interactive summaries first
+        PRIORITY.set(SCHEDULED)
+        started = time.perf_counter()
+        start_time_str = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            summaries = await summarize_digests(rooms, start_time_str, self.max_rooms)
+        except Exception:
+            logger.exception("Could not summarize %s rooms together, summarizing them one by one", len(rooms))
+            summaries = {}
+        SUMMARY_SECONDS.observe(time.perf_counter() - started, kind="digest")
+
+        for room_id, _ in rooms:
+            DIGEST_ROOMS.inc(outcome="batched" if room_id in summaries else "single")
+        results = await asyncio.gather(
+            *(
+                asyncio.to_thread(self.deliver, room_id, room_name, summaries.get(room_id))
+                for room_id, room_name in rooms
+            ),
+            return_exceptions=True,
+        )
+        for (room_id, _), result in zip(rooms, results, strict=True):
+            if isinstance(result, Exception):
+                logger.error("Could not deliver the scheduled summary of room %s", room_id, exc_info=result)
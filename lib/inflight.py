@@ -0,0 +1,74 @@
+"""Deduplication of identical summary requests that are running at the same time"""
+
+import json
+import os
+import threading
+import uuid
+from collections.abc import Hashable
+
+import store
+
+IN_FLIGHT_TTL = int(os.environ.get("IN_FLIGHT_TTL", "3600"))
+"""Seconds after which a summary that a stopped replica left unfinished no longer holds back identical requests"""
+
+
+class InFlight:
+    """Tracks running work by key, so identical requests can join the first one instead of repeating it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: dict[Hashable, int] = {}
+
+    def begin(self, key: Hashable) -> bool:
+        """Returns True if the caller should do the work for ``key``, False if it is already running.
+
+        Every caller that got True has to call ``end`` once the work is done.
+        """
+        with self._lock:
+            if key in self._waiters:
+                self._waiters[key] += 1
+                return False
+            self._waiters[key] = 0
+            return True
+
+    def end(self, key: Hashable) -> int:
+        """Marks the work for ``key`` as done and returns how many requests joined it"""
+        with self._lock:
+            return self._waiters.pop(key, 0)
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+
+class SharedInFlight:
+    """``InFlight`` in the shared database, so identical requests to different replicas are joined as well."""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._holders: dict[Hashable, str] = {}
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return json.dumps(key, default=str)
+
+    def begin(self, key: Hashable) -> bool:
+        holder = f"{store.REPLICA_ID}:{uuid.uuid4().hex}"
+        if not store.begin_in_flight(self._key(key), holder, self.ttl):
+            return False
+        with self._lock:
+            self._holders[key] = holder
+        return True
+
+    def end(self, key: Hashable) -> int:
+        with self._lock:
+            holder = self._holders.pop(key, None)
+        return 0 if holder is None else store.end_in_flight(self._key(key), holder)
+
+    def __len__(self) -> int:
+        """Summaries this replica is generating"""
+        return len(self._holders)
+
+
+SUMMARIES_IN_FLIGHT = SharedInFlight(IN_FLIGHT_TTL) if store.SHARED else InFlight()
+"""Running summaries keyed by ``(conversation_token, duration in seconds, topic or None)``"""
@@ -0,0 +1,245 @@
+"""Write-behind buffer for incoming chat messages"""
+
+import logging
+import os
+import queue
+import threading
+import time
+
+from nc_py_api.ex_app import persistent_storage
+from peewee import InterfaceError, OperationalError
+
+import store
+from metrics import INGEST_DROPPED, INGEST_FLUSH_SECONDS, INGEST_MESSAGES
+from spool import Spool
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "200"))
+"""Flush as soon as this many messages are buffered"""
+
+INGEST_FLUSH_INTERVAL_MS = int(os.environ.get("INGEST_FLUSH_INTERVAL_MS", "250"))
+"""Flush buffered messages at least this often"""
+
+INGEST_BUFFER_SIZE = int(os.environ.get("INGEST_BUFFER_SIZE", "10000"))
+"""Messages that may wait for the writer before new ones are rejected"""
+
+INGEST_SPOOL = os.environ.get("INGEST_SPOOL", "1").lower() not in ("0", "false", "no", "off")
+"""Append incoming messages to a spool file on disk before acknowledging them, so a crash does not lose them"""
+
+INGEST_SPOOL_SYNC_MS = int(os.environ.get("INGEST_SPOOL_SYNC_MS", "5"))
+"""Time the spool collects messages before syncing them to disk together, acknowledgements wait for the sync"""
+
+INGEST_SPOOL_SEGMENT_BYTES = int(os.environ.get("INGEST_SPOOL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+"""Size at which the spool starts a new file, a file is deleted once all its messages are in the database"""
+
+_STOP = object()
+
+# seconds before a batch is stored again while the database is not available, doubled up to the maximum
+_RETRY_DELAY = 0.5
+_MAX_RETRY_DELAY = 30.0
+
+# the database is locked for longer than the busy timeout, unreachable or out of space, storing the batch again later
+# may work
+_UNAVAILABLE = (OperationalError, InterfaceError)
+
+
+class IngestBuffer:
+    """Collects chat messages in memory and writes them in batches from a single writer thread.
+
+    Each flush is one transaction with multi-row INSERTs, so the database pays one commit per batch instead of one
+    per message and producers never contend for the write lock. Producers only append to the buffer, so the webhook
+    handler hands messages over on the event loop and never waits for the database.
+
+    With a ``spool`` every message is also appended to it before it is acknowledged, every batch records the spool
+    position it reached in the same transaction, so messages the last run did not store are replayed exactly once.
+    """
+
+    def __init__(self, batch_size: int, flush_interval_ms: int, max_size: int, spool: Spool | None = None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.spool = spool
+        # replicas sharing a database keep their own spool
+        self._replica = store.REPLICA_ID if store.SHARED else ""
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._stopping = threading.Event()
+        # set when a batch is given up at shutdown, later batches must not move the checkpoint past it
+        self._stalled = False
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def recover(self):
+        """Buffer the spooled messages the last run did not store and open the spool, call before serving webhooks"""
+        if self.spool is None:
+            return
+        checkpoint = store.get_ingest_checkpoint(self._replica)
+        replayed = 0
+        for row, position in self.spool.replay(checkpoint):
+            if isinstance(row["timestamp"], str):
+                # spooled by a version that stored formatted timestamps
+                row["timestamp"] = store.to_epoch(row["timestamp"])
+            self._queue.put((row, position))
+            replayed += 1
+        if replayed:
+            logger.info("Replayed %s spooled messages that were not stored before the restart", replayed)
+        self.spool.open(checkpoint)
+
+    async def offer(self, row: dict) -> bool:
+        """Buffer one ``ChatMessages`` row on the event loop, with a spool it returns once the row is on disk.
+
+        The timestamp of the row is in seconds since the epoch, see ``store.to_epoch``.
+        Returns ``False`` if the buffer is full because the writer does not keep up or the spool cannot be written or
+        synced to disk.
+        """
+        if self._queue.full():
+            return False
+        position = None
+        if self.spool is not None:
+            try:
+                position = self.spool.append(row)
+            except OSError:
+                logger.exception("Could not write a message to the ingest spool")
+                return False
+        # queued in spool order right away, the writer leaves the row out if the sync fails, see ``Spool.settle``.
+        # It cannot be full, nothing else puts rows since the check above.
+        self._queue.put_nowait((row, position))
+        if position is not None:
+            try:
+                await self.spool.synced(position)
+            except OSError:
+                # logged by the spool, the sender retries the webhook
+                return False
+        return True
+
+    def close(self):
+        """Flush everything buffered so far and stop the writer.
+
+        A batch the database does not take is only tried once more, the spool keeps it for the next start.
+        """
+        self._stopping.set()
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self.spool is not None:
+            self.spool.close()
+
+    def drain(self):
+        """Waits until the messages buffered so far are stored, called from a worker thread"""
+        drained = threading.Event()
+        self._queue.put(drained)
+        drained.wait()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            drained = None
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    drained = item
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._flush(batch)
+            if drained is not None:
+                drained.set()
+
+    def _flush(self, batch: list[tuple[dict, tuple[int, int] | None]]):
+        position = batch[-1][1]
+        if position is not None:
+            unsynced = set(self.spool.settle(position))
+            if unsynced:
+                logger.debug("Leaving out %s messages that could not be synced to the spool", len(unsynced))
+                batch = [item for item in batch if item[1] not in unsynced]
+        if self._stalled:
+            if position is None:
+                INGEST_DROPPED.inc(len(batch))
+            return
+        pending = list(batch)
+        delay = _RETRY_DELAY
+        while True:
+            try:
+                self._store(pending, position)
+                break
+            except _UNAVAILABLE:
+                if self._stopping.is_set():
+                    logger.exception("Could not store %s buffered messages before the shutdown", len(pending))
+                    self._stalled = True
+                    if position is None:
+                        INGEST_DROPPED.inc(len(pending))
+                    return
+                logger.exception("Could not store %s buffered messages, trying again in %ss", len(pending), delay)
+                # the queue fills up in the meantime and further webhooks are rejected
+                self._stopping.wait(delay)
+                delay = min(delay * 2, _MAX_RETRY_DELAY)
+        if position is not None:
+            self.spool.release(position)
+
+    def _store(self, pending: list[tuple[dict, tuple[int, int] | None]], position: tuple[int, int] | None):
+        """Stores the rows and the spool ``position`` behind them, rows are removed from ``pending`` once stored.
+
+        Rows that can never be stored are dropped one by one, a database that is not available stops the writer.
+
+        :raises OperationalError: if the database is not available, the rest of ``pending`` is tried again
+        """
+        try:
+            self._write(pending, position)
+            pending.clear()
+            return
+        except _UNAVAILABLE:
+            raise
+        except Exception:
+            logger.exception("Error occured while storing %s buffered messages, storing them one by one", len(pending))
+        while pending:
+            row, row_position = pending[0]
+            try:
+                self._write(pending[:1], row_position)
+            except _UNAVAILABLE:
+                raise
+            except Exception:
+                INGEST_DROPPED.inc()
+                logger.exception("Dropping a message of room %s that cannot be stored", row["room_id"])
+            pending.pop(0)
+        if position is not None:
+            # the last rows may have been dropped
+            self._write([], position)
+
+    def _write(self, items: list[tuple[dict, tuple[int, int] | None]], position: tuple[int, int] | None):
+        with INGEST_FLUSH_SECONDS.time():
+            store.create_partitions(row["timestamp"] for row, _ in items)
+            with store.db.atomic():
+                store.insert_messages([row for row, _ in items])
+                if position is not None:
+                    store.set_ingest_checkpoint(self._replica, position)
+        INGEST_MESSAGES.inc(len(items))
+        logger.debug("Stored %s buffered messages", len(items))
+
+
+INGEST_BUFFER = IngestBuffer(
+    INGEST_BATCH_SIZE,
+    INGEST_FLUSH_INTERVAL_MS,
+    INGEST_BUFFER_SIZE,
+    (
+        Spool(
+            os.path.join(persistent_storage(), "ingest_spool", store.REPLICA_ID if store.SHARED else ""),
+            INGEST_SPOOL_SEGMENT_BYTES,
+            INGEST_SPOOL_SYNC_MS,
+        )
+        if INGEST_SPOOL
+        else None
+    ),
+)
@@ -0,0 +1,224 @@
+"""Daily summary jobs, persisted in the message database and run by APScheduler"""
+
+import contextlib
+import hashlib
+import logging
+import os
+import random
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import store
+from leader import LEADER
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+SCHEDULE_MISFIRE_GRACE = int(os.environ.get("SCHEDULE_MISFIRE_GRACE", "3600"))
+"""Seconds a missed run, for example during a restart, may be late and still be executed once"""
+
+SCHEDULE_JITTER = int(os.environ.get("SCHEDULE_JITTER", "300"))
+"""Up to this many seconds scheduled runs start later, so rooms scheduled for the same time do not all run at once"""
+
+JOB_SYNC_INTERVAL = int(os.environ.get("JOB_SYNC_INTERVAL", "30"))
+"""Seconds between two loads of the jobs other replicas added or deleted, only used with a shared database"""
+
+scheduler = BackgroundScheduler(job_defaults={"coalesce": True, "misfire_grace_time": SCHEDULE_MISFIRE_GRACE})
+
+JobRunner = Callable[[str, str, str], None]
+"""Called with ``room_id``, ``room_name`` and ``job_id`` when a job is due"""
+
+
+@dataclass(frozen=True)
+class JobInfo:
+    job_id: str
+    room_id: str
+    room_name: str
+    hour: int
+    minute: int
+
+
+class JobRegistry:
+    """Scheduled jobs indexed by id and by room, kept in step with the scheduler.
+
+    Looking up the jobs of a room costs only as much as that room has jobs, instead of going through every job of
+    the scheduler.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id: dict[str, JobInfo] = {}
+        self._by_room: dict[str, dict[str, JobInfo]] = {}
+
+    def add(self, job: JobInfo):
+        with self._lock:
+            self._by_id[job.job_id] = job
+            self._by_room.setdefault(job.room_id, {})[job.job_id] = job
+
+    def remove(self, job_id: str) -> JobInfo | None:
+        with self._lock:
+            job = self._by_id.pop(job_id, None)
+            if job is None:
+                return None
+            room_jobs = self._by_room[job.room_id]
+            del room_jobs[job_id]
+            if not room_jobs:
+                del self._by_room[job.room_id]
+            return job
+
+    def get(self, job_id: str) -> JobInfo | None:
+        return self._by_id.get(job_id)
+
+    def ids(self) -> list[str]:
+        with self._lock:
+            return list(self._by_id)
+
+    def for_room(self, room_id: str) -> list[JobInfo]:
+        """Jobs of a room, ordered by time of day"""
+        with self._lock:
+            room_jobs = list(self._by_room.get(room_id, {}).values())
+        return sorted(room_jobs, key=lambda job: (job.hour, job.minute, job.job_id))
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+
+REGISTRY = JobRegistry()
+
+_runner: JobRunner | None = None
+
+
+def make_job_id(room_id: str, room_name: str, hour: int, minute: int) -> str:
+    return f"{room_id}_{hashlib.md5(f'{room_id}_{room_name}_{hour}_{minute}'.encode()).hexdigest()}"  # noqa: S324
+
+
+def _last_fire_time(hour: int, minute: int, now: datetime) -> datetime:
+    fire_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return fire_time if fire_time <= now else fire_time - timedelta(days=1)
+
+
+def _job_info(job: store.ScheduledJobs) -> JobInfo:
+    return JobInfo(job.job_id, job.room_id, job.room_name, job.hour, job.minute)
+
+
+def _run_if_leader(run: JobRunner, room_id: str, room_name: str, job_id: str):
+    # every replica schedules all jobs, so another one can take over right away
+    if not LEADER.is_leader:
+        logger.debug("Skipping job %s, another replica runs the scheduled jobs", job_id)
+        return
+    run(room_id, room_name, job_id)
+
+
+def _schedule(job: store.ScheduledJobs, run: JobRunner, next_run_time: datetime | None = None):
+    kwargs = {"next_run_time": next_run_time} if next_run_time else {}
+    scheduler.add_job(
+        _run_if_leader,
+        "cron",
+        args=(run, job.room_id, job.room_name, job.job_id),
+        hour=job.hour,
+        minute=job.minute,
+        day_of_week="*",
+        jitter=SCHEDULE_JITTER or None,
+        id=job.job_id,
+        replace_existing=True,
+        **kwargs,
+    )
+    REGISTRY.add(_job_info(job))
+
+
+def load_jobs(run: JobRunner):
+    """Puts all persisted jobs into the scheduler.
+
+    A job whose last due run was missed while the bot was down is run once within the next ``SCHEDULE_JITTER``
+    seconds, if it is not later than ``SCHEDULE_MISFIRE_GRACE`` seconds. With a shared database the jobs are loaded
+    again every ``JOB_SYNC_INTERVAL`` seconds.
+    """
+    global _runner
+    _runner = run
+    now = datetime.now()
+    count = 0
+    for job in store.ScheduledJobs.select():
+        fire_time = _last_fire_time(job.hour, job.minute, now)
+        missed = fire_time > max(job.last_run or job.created_at, job.created_at)
+        if missed and (now - fire_time).total_seconds() <= SCHEDULE_MISFIRE_GRACE:
+            logger.info("Catching up on missed run of job %s due at %s", job.job_id, fire_time)
+            _schedule(job, run, next_run_time=now + timedelta(seconds=random.uniform(0, SCHEDULE_JITTER)))  # noqa: S311
+        else:
+            _schedule(job, run)
+        count += 1
+    logger.debug("Loaded %s scheduled jobs", count)
+    if store.SHARED:
+        scheduler.add_job(sync, "interval", seconds=JOB_SYNC_INTERVAL, id="job-sync", replace_existing=True)
+
+
+def sync():
+    """Brings scheduler and registry in step with the jobs that other replicas added or deleted"""
+    _reconcile({job.job_id: job for job in store.ScheduledJobs.select()}, REGISTRY.ids())
+
+
+def _sync_room(room_id: str):
+    query = store.ScheduledJobs.select().where(store.ScheduledJobs.room_id == room_id)
+    _reconcile({job.job_id: job for job in query}, [job.job_id for job in REGISTRY.for_room(room_id)])
+
+
+def _sync_job(job_id: str):
+    job = store.ScheduledJobs.get_or_none(store.ScheduledJobs.job_id == job_id)
+    _reconcile({job_id: job} if job else {}, [job_id] if REGISTRY.get(job_id) else [])
+
+
+def _reconcile(persisted: dict[str, store.ScheduledJobs], known: list[str]):
+    for job_id in known:
+        if job_id not in persisted and REGISTRY.remove(job_id) is not None:
+            with contextlib.suppress(JobLookupError):
+                scheduler.remove_job(job_id)
+    for job_id, job in persisted.items():
+        if REGISTRY.get(job_id) is None:
+            _schedule(job, _runner)
+
+
+def add_job(room_id: str, room_name: str, hour: int, minute: int, run: JobRunner) -> str:
+    job = store.ScheduledJobs.create(
+        job_id=make_job_id(room_id, room_name, hour, minute),
+        room_id=room_id,
+        room_name=room_name,
+        hour=hour,
+        minute=minute,
+        created_at=datetime.now(),
+    )
+    try:
+        _schedule(job, run)
+    except Exception:
+        job.delete_instance()
+        raise
+    return job.job_id
+
+
+def remove_job(job_id: str):
+    scheduler.remove_job(job_id)
+    REGISTRY.remove(job_id)
+    store.ScheduledJobs.delete_by_id(job_id)
+
+
+def get_job(job_id: str) -> JobInfo | None:
+    if store.SHARED:
+        _sync_job(job_id)
+    return REGISTRY.get(job_id)
+
+
+def room_jobs(room_id: str) -> list[JobInfo]:
+    if store.SHARED:
+        # only this room, all jobs are synced every JOB_SYNC_INTERVAL seconds
+        _sync_room(room_id)
+    return REGISTRY.for_room(room_id)
+
+
+def mark_run(job_id: str) -> datetime | None:
+    """Records a run of a job and returns when it ran before, None if it never did"""
+    with store.db.atomic():
+        job = store.ScheduledJobs.get_or_none(store.ScheduledJobs.job_id == job_id)
+        store.ScheduledJobs.update(last_run=datetime.now()).where(store.ScheduledJobs.job_id == job_id).execute()
+    return job.last_run if job else None
@@ -0,0 +1,79 @@
+"""Bounded worker lanes for background work"""
+
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+
+class LaneFullError(Exception):
+    pass
+
+
+class Lane:
+    """A thread pool with a fixed number of workers and a bounded backlog.
+
+    ``ThreadPoolExecutor`` queues without limit, so a lane keeps a semaphore with one slot per worker plus one per
+    queued item and rejects new work with ``LaneFullError`` once all slots are taken.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"lane-{name}")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of submitted items that are waiting for a free worker"""
+        return self._queued
+
+    @property
+    def active(self) -> int:
+        """Number of items being processed right now"""
+        return self._active
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Lane '%s' is full (%s queued), rejecting work", self.name, self._queued)
+            raise LaneFullError(f"The {self.name} lane is full")
+
+        with self._lock:
+            self._queued += 1
+        try:
+            future = self._executor.submit(self._run, fn, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            self._slots.release()
+            raise
+        logger.debug("Lane '%s': %s active, %s queued", self.name, self._active, self._queued)
+        return future
+
+    def _run(self, fn, *args, **kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._slots.release()
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+SUMMARY_LANE = Lane(
+    "summary",
+    max_workers=int(os.environ.get("SUMMARY_WORKERS", "8")),
+    max_queue=int(os.environ.get("SUMMARY_QUEUE_SIZE", "32")),
+)
+"""Runs bot commands, including the long running summary generation"""
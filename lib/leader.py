@@ -0,0 +1,81 @@
+"""Leader election between replicas sharing the database, only the leader runs scheduled jobs"""
+
+import logging
+import os
+import threading
+import time
+
+import store
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+LEADER_LEASE_SECONDS = float(os.environ.get("LEADER_LEASE_SECONDS", "30"))
+"""Seconds the lease of the leader lasts without a renewal, another replica takes over once it expired"""
+
+SCHEDULER_LEASE = "scheduler"
+
+
+class Leader:
+    """Holds a lease in the shared database and renews it from a background thread every third of its duration.
+
+    A replica regards itself as leader for two thirds of the lease after a successful renewal, so a stalled leader
+    steps down before another replica can take over, as long as their clocks differ by less than a third of the lease.
+    Without a shared database the only replica is always the leader.
+    """
+
+    def __init__(self, name: str, holder: str, lease_seconds: float, enabled: bool):
+        self.name = name
+        self.holder = holder
+        self.lease_seconds = lease_seconds
+        self.enabled = enabled
+        self._until = 0.0 if enabled else float("inf")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{name}", daemon=True)
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._until
+
+    def start(self):
+        """Tries to become leader right away, then keeps renewing in the background"""
+        if not self.enabled:
+            return
+        self.renew()
+        self._thread.start()
+
+    def renew(self):
+        started = time.monotonic()
+        was_leader = self.is_leader
+        try:
+            acquired = store.acquire_lease(self.name, self.holder, self.lease_seconds)
+        except Exception:
+            # the lease runs out by itself if the database stays unreachable
+            logger.exception("Could not renew the %s lease", self.name)
+            return
+        self._until = started + self.lease_seconds * 2 / 3 if acquired else 0.0
+        if acquired and not was_leader:
+            logger.info("Replica %s is now the leader and runs the scheduled jobs", self.holder)
+        elif was_leader and not acquired:
+            logger.warning("Replica %s lost the %s lease to another replica", self.holder, self.name)
+
+    def stop(self):
+        """Stops renewing and hands the lease on right away"""
+        if not self.enabled:
+            return
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        if self.is_leader:
+            self._until = 0.0
+            try:
+                store.release_lease(self.name, self.holder)
+            except Exception:
+                logger.exception("Could not release the %s lease", self.name)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            self.renew()
+
+
+LEADER = Leader(SCHEDULER_LEASE, store.REPLICA_ID, LEADER_LEASE_SECONDS, store.SHARED)
+"""Decides which replica runs scheduled summaries and the retention job"""
@@ -1,23 +1,20 @@
 """Summary Talk Bot"""
 
-import hashlib
+import asyncio
+import contextlib
 import logging
 import os
 import re
 import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import Annotated
 
 import tzlocal
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-from apscheduler.triggers.cron.fields import BaseField
-from fastapi import Depends, FastAPI, Response
-from nc_py_api import Nextcloud, NextcloudApp, talk_bot
-from nc_py_api.ex_app import atalk_bot_msg, run_app, set_handlers, setup_nextcloud_logging
+from fastapi import Body, Depends, FastAPI, Response
+from nc_py_api import AsyncNextcloudApp, NextcloudApp, talk_bot
+from nc_py_api.ex_app import anc_app, atalk_bot_msg, run_app, set_handlers, setup_nextcloud_logging
 from timelength import TimeLength
 
 #### For local dev purposes
@@ -31,11 +28,20 @@ from timelength import TimeLength
 # os.environ["APP_PERSISTENT_STORAGE"] = "/tmp/"
 
 # Imported here to register environment variables before importing store (only for local dev purposes)
+import jobs
+import metrics
+import retention
 import store
-
-
-class LLMException(Exception):
-    pass
+from admission import SUMMARY_ADMISSION, AdmissionError, Ticket
+from digest import SCHEDULE_BATCH, SCHEDULE_BATCH_ROOMS, SCHEDULE_BATCH_WINDOW, DigestBatcher
+from leader import LEADER
+from inflight import SUMMARIES_IN_FLIGHT
+from ingest import INGEST_BUFFER
+from lanes import SUMMARY_LANE, LaneFullError
+from ncclient import PooledTalkBot
+from pacing import INTERACTIVE, PRIORITY, SCHEDULE_CONCURRENCY, SCHEDULED
+from summarize import summarize_room, summarize_topic
+from taskproc import TASK_TRACKER, TASK_TYPES, TASK_WEBHOOK_PATH, LLMException
 
 
 logging.basicConfig(
@@ -51,55 +57,36 @@ setup_nextcloud_logging(os.environ["APP_ID"], logging.WARNING)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     set_handlers(app, enabled_handler)
+    INGEST_BUFFER.recover()
+    LEADER.start()
+    jobs.load_jobs(sched_process_request)
+    retention.start()
     yield
+    LEADER.stop()
+    INGEST_BUFFER.close()
+    SUMMARY_LANE.shutdown(wait=False)
+    BOT.close()
 
 
 APP = FastAPI(lifespan=lifespan)
 
 # We define bot globally, so if no `multiprocessing` module is used, it can be reused by calls.
-# All stuff in it works only with local variables, so in the case of multithreading, there should not be problems.
-BOT = talk_bot.TalkBot(
+# Messages are sent through one shared keep-alive session, which is safe to use from several threads.
+BOT = PooledTalkBot(
     f"/{os.environ['APP_ID']}",
     f"{os.environ['APP_DISPLAY_NAME']}",
     "For usage instructions, type: @summary help",
 )
 
-SUMMARY_TEMPLATE = """You are a secretary and tasked with providing an insightful and succint summarization of a chat log.
-The chat log will be provided to you below will be defined in an XML format inside triple single quotes.
-Each message will be encapsulated in a <msg> tag, with the following subtags:
-<ts> for the timestamp of the message
-<at> for the name of the participant
-<cnt> for the message content
-
-Here is the chat log from the room called "{conversation_name}" that you should summarize, do not mention the room explicitly:
-
-'''
-{messages}
-'''
-
-
-Now, please provide an insighful summary of the provided chat log and use human-readable time references for time related information.
-Use bullet points to list the most important facts and keep the summary concise and readable in roughly 30 seconds.
-""" # noqa: E501
-
-PROMPT_WINDOW = 16_000 - 4_000
-"""Most models (proprietory and local) have an effective context length of 16000 tokens. We leave 4000 tokens for the
-generated summary and 12000 tokens for the context."""
-
-MAX_WORDS = int(PROMPT_WINDOW // 1.5)
-"""Taking 1 word ~ 1.5 tokens to be on the safe side for languages other than English"""
-
-MAX_CHARACTERS = MAX_WORDS * 5
-
-
-scheduler = BackgroundScheduler()
+scheduler = jobs.scheduler
 scheduler.start()
 
-# We need to use ThreadPoolExecutor for message store and taskproc API calls
-executor = ThreadPoolExecutor(max_workers=10)
 
+TOPIC_DEFAULT_DURATION = "30d"
 
-available_params = ["add", "list", "delete", "help"]
+available_params = ["add", "list", "delete", "retention", "about", "help"]
+
+BOT_MENTION = re.compile(r"^@summary$|^@summary\s.*", re.IGNORECASE)
 
 
 def error_handler(custom_err_msg: str, message: talk_bot.TalkBotMessage | None = None):
@@ -114,68 +101,29 @@ def is_valid_time(hour, minute):
 
 
 def is_task_type_available():
-    try:
-        nc = Nextcloud()
-        tasktype_result = nc.ocs(method="GET", path="/ocs/v2.php/taskprocessing/tasktypes")
-    except Exception:
-        error_handler("An error occurred while fetching the list of available tasktypes")
-        return False
+    return TASK_TYPES.get().available
 
-    # Check for the specific task type ID
-    task_type = "core:text2text"
-    if not isinstance(tasktype_result, dict) or task_type not in tasktype_result.get("types", {}):
-        error_handler(f"The neccessary task type: {task_type} is not available")
-        return False
 
-    return True
+def scheduled_message(room_id: str, room_name: str) -> talk_bot.TalkBotMessage:
+    """Stands in for the message a summary replies to when it was started by a scheduled job.
 
-
-def validate_task_response(response) -> dict:
-    if not isinstance(response, dict) or "task" not in response:
-        raise LLMException("Failed to create Nextcloud TaskProcessing task")
-
-    task = response["task"]
-
-    if not isinstance(task, dict) or "id" not in task or "status" not in task or "output" not in task:
-        raise LLMException("Invalid Nextcloud TaskProcessing task response")
-
-    return task
-
-
-def ocs_get_summary(messages_str: str, conversation_name: str) -> str:
-    nc = Nextcloud()
-    prompt = SUMMARY_TEMPLATE.format(messages=messages_str, conversation_name=conversation_name)
-    response = nc.ocs(
-        "POST",
-        "/ocs/v2.php/taskprocessing/schedule",
-        json={"type": "core:text2text", "appId": os.environ["APP_ID"], "input": {"input": prompt}},
+    Replying to message id 0 posts a new message to the room.
+    """
+    return talk_bot.TalkBotMessage(
+        {
+            "type": "Create",
+            "actor": {
+                "type": "Application",
+                "id": f"bots/{os.environ['APP_ID']}",
+                "name": os.environ["APP_DISPLAY_NAME"],
+            },
+            "object": {"type": "Note", "id": 0, "name": "message", "content": "{}", "mediaType": "text/plain"},
+            "target": {"type": "Collection", "id": room_id, "name": room_name},
+        }
     )
 
-    try:
-        task = validate_task_response(response)
-        logger.debug("Task with ID %s created", task["id"])
-
-        i = 0
-        # wait for 30 minutes
-        while task["status"] != "STATUS_SUCCESSFUL" and task["status"] != "STATUS_FAILED" and i < 60 * 6:
-            time.sleep(5)
-            i += 1
-            response = nc.ocs("GET", f"/ocs/v2.php/taskprocessing/task/{task['id']}")
-            task = validate_task_response(response)
-            logger.debug("Task (%s) status: %s", task["id"], task["status"])
-    except Exception as e:
-        raise LLMException("Failed to create Nextcloud TaskProcessing task") from e
-
-    if task["status"] != "STATUS_SUCCESSFUL":
-        raise LLMException("Nextcloud TaskProcessing Task failed: " + task["status"])
-
-    if "output" not in task or "output" not in task["output"]:
-        raise LLMException("No output in Nextcloud TaskProcessing task")
 
-    return task["output"]["output"]
-
-
-def sched_process_request(message: talk_bot.TalkBotMessage, job_hash: str):
+def sched_process_request(room_id: str, room_name: str, job_hash: str):
     # set_user needed for accessing the Talk API to get all messages
     # waiting for https://github.com/nextcloud/spreed/issues/10401 as
     # talk api doesnt provide the feature to get the participants of a room
@@ -201,37 +149,41 @@ def sched_process_request(message: talk_bot.TalkBotMessage, job_hash: str):
     #    messages characters, or fear a <Response [414 Request-URI Too Long]> if it exceeds 5400 characters
     #
     ##############
-    last_x_duration_process(message, "1d")
-
-
-def get_ctx_limited_messages(chat_messages: list[store.ChatMessages]) -> tuple[str, str | None]:
-    """Get the last messages that fit into the context window of the model.
-        The second return is the cut-off datetime of the messages.
-    """
-
-    msgs = ""
-    length = 0
-    cutoff = None
-
-    for i in range(len(chat_messages) - 1, -1, -1):
-        msg = format_message(chat_messages[i])
-        if (length := length + len(msg)) > MAX_CHARACTERS:
-            cutoff = str(chat_messages[max(0, i-1)].timestamp)
-            break
+    previous_run = jobs.mark_run(job_hash)
+    since = datetime.now() - timedelta(days=1)
+    if previous_run is not None and previous_run > since:
+        since = previous_run
+    if not store.has_messages(room_id, since.strftime("%Y-%m-%d %H:%M:%S")):
+        # nothing to summarize, no task is created
+        metrics.DIGEST_ROOMS.inc(outcome="skipped")
+        logger.debug("Skipping job %s, nothing was said since its last run", job_hash)
+        return
+    if SCHEDULE_BATCH:
+        DIGESTS.submit(room_id, room_name)
+        return
+    last_x_duration_process(scheduled_message(room_id, room_name), "1d", SCHEDULED)
 
-        msgs = msg + "\n" + msgs
 
-    if not msgs:
-        return str(chat_messages[0]), None
+def deliver_digest(room_id: str, room_name: str, summary: str | None):
+    """Posts the summary of a room from a digest batch, rooms without one are summarized on their own"""
+    message = scheduled_message(room_id, room_name)
+    if summary is None:
+        last_x_duration_process(message, "1d", SCHEDULED)
+    else:
+        post_summary(message, summary, None)
 
-    return msgs, cutoff
 
+DIGESTS = DigestBatcher(SCHEDULE_BATCH_WINDOW, SCHEDULE_BATCH_ROOMS, deliver_digest)
 
-def last_x_duration_process(message: talk_bot.TalkBotMessage, hduration: str = "1d"):
-    if not is_task_type_available():
-        BOT.send_message("```The required task type to generate the summary is not available```", message)
-        return
 
+def last_x_duration_process(
+    message: talk_bot.TalkBotMessage,
+    hduration: str = "1d",
+    priority: int = INTERACTIVE,
+    topic: str | None = None,
+    announcement: str = "",
+):
+    """Starts a summary of the last ``hduration``, ``announcement`` is posted once a command's summary is admitted"""
     timelength_res = TimeLength(hduration)
     if not timelength_res.result.success:
         help_message(
@@ -241,38 +193,114 @@ def last_x_duration_process(message: talk_bot.TalkBotMessage, hduration: str = "
         )
         return
 
-    duration = timedelta(seconds=timelength_res.to_seconds(max_precision=0))
-    current_time = datetime.now()
-    start_time = current_time - duration
-    start_time_str = start_time.strftime("%Y-%m-%d %H:%M:%S")
+    duration_seconds = timelength_res.to_seconds(max_precision=0)
+    # identical requests of a room share one summary, it is posted to the room once it is ready
+    inflight_key = (message.conversation_token, duration_seconds, topic.lower() if topic else None)
+    if not SUMMARIES_IN_FLIGHT.begin(inflight_key):
+        about = f" about '{topic}'" if topic else ""
+        BOT.send_message(
+            f"```A summary{about} of the last {hduration} is already being generated for"
+            f" '{message.conversation_name}', it will be posted here once it is ready```",
+            message,
+        )
+        return
 
+    ticket = None
     try:
-        # Get the chat messages from the database
-        chat_messages = store.ChatMessages \
-            .select() \
-            .where(store.ChatMessages.room_id == message.conversation_token) \
-            .where(store.ChatMessages.timestamp >= start_time_str)
-
-        if chat_messages.count() == 0:
-            BOT.send_message(f"```There was no conversation since i joined '{message.conversation_name}'```", message)
+        if not is_task_type_available():
+            BOT.send_message("```The required task type to generate the summary is not available```", message)
+            SUMMARIES_IN_FLIGHT.end(inflight_key)
             return
+
+        if priority == INTERACTIVE:
+            try:
+                ticket = SUMMARY_ADMISSION.admit(message.conversation_token, duration_seconds)
+            except AdmissionError as e:
+                metrics.SUMMARIES_REJECTED.inc(reason=e.reason)
+                BOT.send_message(f"```{e}```", message)
+                SUMMARIES_IN_FLIGHT.end(inflight_key)
+                return
+            if ticket.position:
+                announcement = f"{announcement or 'Creating a summary'} - queued at position {ticket.position}"
+            if announcement:
+                BOT.send_message(f"```{announcement}```", message)
+
+        start_time = datetime.now() - timedelta(seconds=duration_seconds)
+        # the summary is awaited on the task tracker loop, the worker thread is free again right away
+        TASK_TRACKER.spawn(
+            generate_summary(message, start_time.strftime("%Y-%m-%d %H:%M:%S"), inflight_key, priority, topic, ticket)
+        )
     except Exception:
-        error_handler("Error occured while fetching the messages from the database", message)
-        return
+        if ticket is not None:
+            SUMMARY_ADMISSION.release(ticket)
+        SUMMARIES_IN_FLIGHT.end(inflight_key)
+        raise
+
+
+def post_summary(message: talk_bot.TalkBotMessage, summary: str, cutoff: str | None):
+    tz = tzlocal.get_localzone() or "server's"
+    ai_info = (
+        "\u2139\ufe0f *This output was generated by AI. Make sure to double-check."
+        f" (All times are in {tz} timezone)*\n"
+    )
+    if cutoff:
+        ai_info += f"\n\n*Note: Messages before \"{cutoff}\" were not included in the summary due to the length limit.*"
+    BOT.send_message(f"""**Summary:**\n{summary}\n\n{ai_info}""", message)
+
+
+# only awaited on the task tracker loop
+SCHEDULED_SUMMARIES = asyncio.Semaphore(SCHEDULE_CONCURRENCY)
 
-    (formatted_chat_messages, cutoff) = get_ctx_limited_messages(chat_messages)
+
+async def generate_summary(
+    message: talk_bot.TalkBotMessage,
+    start_time_str: str,
+    inflight_key: tuple,
+    priority: int = INTERACTIVE,
+    topic: str | None = None,
+    ticket: Ticket | None = None,
+):
+    # inherited by all tasks of this summary, the task limiter serves interactive summaries first
+    PRIORITY.set(priority)
+    started = time.perf_counter()
     try:
-        summary = ocs_get_summary(formatted_chat_messages, message.conversation_name)
-        tz = tzlocal.get_localzone() or "server's"
-        ai_info = (
-            "\u2139\ufe0f *This output was generated by AI. Make sure to double-check."
-            f" (All times are in {tz} timezone)*\n"
-        )
-        if cutoff:
-            ai_info += f"\n\n*Note: Messages before \"{cutoff}\" were not included in the summary due to the length limit.*"
-        BOT.send_message(f"""**Summary:**\n{summary}\n\n{ai_info}""", message)
+        if ticket is not None:
+            await SUMMARY_ADMISSION.wait(ticket)
+        if topic:
+            summary = await summarize_topic(
+                message.conversation_token, message.conversation_name, topic, start_time_str
+            )
+            if summary is None:
+                await asyncio.to_thread(
+                    BOT.send_message, f"```Nothing was said about '{topic}' in that time```", message
+                )
+                return
+            result = (summary, None)
+        else:
+            async with SCHEDULED_SUMMARIES if priority == SCHEDULED else contextlib.nullcontext():
+                result = await summarize_room(message.conversation_token, message.conversation_name, start_time_str)
+        if result is None:
+            await asyncio.to_thread(
+                BOT.send_message,
+                f"```There was no conversation since i joined '{message.conversation_name}'```",
+                message,
+            )
+            return
+
+        (summary, cutoff) = result
+        await asyncio.to_thread(post_summary, message, summary, cutoff)
     except LLMException:
-        error_handler("Could not get a summary from any large language model", message)
+        await asyncio.to_thread(error_handler, "Could not get a summary from any large language model", message)
+    except Exception:
+        await asyncio.to_thread(error_handler, "Error occured while fetching the messages from the database", message)
+    finally:
+        if ticket is not None:
+            SUMMARY_ADMISSION.release(ticket)
+        kind = "topic" if topic else "scheduled" if priority == SCHEDULED else "interactive"
+        metrics.SUMMARY_SECONDS.observe(time.perf_counter() - started, kind=kind)
+        joined = await asyncio.to_thread(SUMMARIES_IN_FLIGHT.end, inflight_key)
+        if joined:
+            logger.debug("%s identical summary requests were answered together", joined + 1)
 
 
 def is_numbers_and_colon(s: str):
@@ -301,6 +329,12 @@ List scheduled {os.environ["APP_DISPLAY_NAME"]} jobs:
 Delete a {os.environ["APP_DISPLAY_NAME"]} job:
     @summary delete <job_id>
 
+Create a summary of what was said about a topic, in the last 30 days or the provided duration:
+    @summary about <topic> [<duration>]
+
+Show or change how long messages of this conversation are kept for summaries ("14d" for 14 days, "default" for the server setting):
+    @summary retention [<duration>|default]
+
 Prints a help message:
     @summary help
 ```
@@ -333,14 +367,20 @@ def render_activity_message(message: talk_bot.TalkBotMessage) -> str:
     return msg
 
 
-def store_message(tmsg: talk_bot.TalkBotMessage):
+async def store_message(tmsg: talk_bot.TalkBotMessage, received_at: datetime) -> bool:
+    """Buffers a message for the writer on the event loop, it only waits for the spool to reach the disk.
+
+    Returns ``False`` if the message was not taken, messages that are not stored count as taken.
+    """
     logger.debug("\033[1;44mMessage\033[0m %s", tmsg._raw_data)
     message = ""
     match tmsg.message_type:
         case "Join":
             message = f"{tmsg.actor_display_name} added Summary bot to the conversation"
         case "Leave":
-            message = f"{tmsg.actor_display_name} removed Summary bot from the conversation"
+            # nothing of a room the bot was removed from is needed anymore
+            scheduler.add_job(retention.forget_room, args=(tmsg.conversation_token, received_at))
+            return True
         case "Create" if tmsg.object_media_type.startswith("text/") and not tmsg.actor_id.startswith("bot"):
             # text messages which are not from other bots
             message = tmsg.object_content["message"]
@@ -349,33 +389,21 @@ def store_message(tmsg: talk_bot.TalkBotMessage):
                 message = render_activity_message(tmsg)
             except KeyError:
                 logger.warning("KeyError in parsing the activity message: %s", tmsg.object_content)
-                return
+                return True
             except NotImplementedError:
-                return
+                return True
         case _:
             logger.debug("Unsupported message type: %s", tmsg.message_type)
-            return
-
-    try:
-        # all calculations based on server time
-        current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        store.ChatMessages.create(
-            timestamp=current_datetime,
-            room_id=tmsg.conversation_token,
-            actor=tmsg.actor_display_name,
-            message=message,
-        )
-    except Exception:
-        error_handler("Error occured while storing the message")
-
-
-def format_message(message: store.ChatMessages) -> str:
-    return (
-        "<msg>"
-        f"<ts>{message.timestamp}</ts>"
-        f"<at>{message.actor}</at>"
-        f"<cnt>{message.message}</cnt>"
-        "</msg>"
+            return True
+
+    # all calculations based on server time, taken when the webhook arrived
+    return await INGEST_BUFFER.offer(
+        {
+            "timestamp": store.to_epoch(received_at),
+            "room_id": tmsg.conversation_token,
+            "actor": tmsg.actor_display_name,
+            "message": message,
+        }
     )
 
 
@@ -385,16 +413,16 @@ def handle_command(message: talk_bot.TalkBotMessage):
 
     if message.object_content["message"].strip() == "@summary":
         # Create a summary from last 24 hours of chat messages
-        BOT.send_message("```Creating a summary from last 24 hours of chat messages```", message)
-        last_x_duration_process(message)
+        last_x_duration_process(message, announcement="Creating a summary from last 24 hours of chat messages")
     elif message.object_content["message"].startswith("@summary "):
         param = message.object_content["message"].split(" ")[1]
         if param not in available_params:
             if TimeLength(param).result.success:
                 # Create a summary from last provided duration of chat messages ("30m" for 30 minutes, "3h40m"
                 # for 3 hours and 40 minutes, "1d" for 1 day):
-                BOT.send_message(f"```Creating a summary from last {param} of chat messages```", message)
-                last_x_duration_process(message, param)
+                last_x_duration_process(
+                    message, param, announcement=f"Creating a summary from last {param} of chat messages"
+                )
                 return
 
             help_message(
@@ -434,57 +462,12 @@ def handle_command(message: talk_bot.TalkBotMessage):
                     )
                     return
 
-                # Parameters for the new job
-                new_job_hour = int(hour)
-                new_job_minute = int(minute)
-                new_job_hash = f"{conversation_token}_{hashlib.md5(f'{conversation_token}_{conversation_name}_{new_job_hour}_{new_job_minute}'.encode()).hexdigest()}" # noqa: E501, S324
-
                 # Check if a similar job already exists
-                job_exists = False
-                job_hash = new_job_hash
-
-                job_hour = -1
-                job_minute = -1
-                for job in scheduler.get_jobs():
-                    trigger = job.trigger
-
-                    old_conversation_token = job.id.split("_")[0]
-
-                    if isinstance(trigger, CronTrigger):
-                        job_hour = trigger.fields[trigger.FIELD_NAMES.index("hour")]
-                        job_minute = trigger.fields[trigger.FIELD_NAMES.index("minute")]
-                        job_day_of_week = trigger.fields[trigger.FIELD_NAMES.index("day_of_week")]
-
-                        old_job_hash = f"{old_conversation_token}_{hashlib.md5(f'{old_conversation_token}_{conversation_name}_{job_hour}_{job_minute}'.encode()).hexdigest()}" # noqa: E501, S324
-
-                        if isinstance(job_hour, BaseField):
-                            job_hour = job_hour.expressions[0]
-                            job_hour = int(f"{hour}")
-
-                        if isinstance(job_minute, BaseField):
-                            job_minute = job_minute.expressions[0]
-                            job_minute = int(f"{job_minute}")
-
-                        if (
-                            job_hour == new_job_hour
-                            and job_minute == new_job_minute
-                            and old_job_hash == new_job_hash
-                        ):
-                            job_exists = True
-                            break
-
-                if job_exists:
-                    if job_hour <= 9:
-                        job_hour = f"0{job_hour}"
-                    if job_minute <= 9:
-                        job_minute = f"0{job_minute}"
-
-                    if job_hour == -1 or job_minute == -1:
-                        return
-
+                new_job_hash = jobs.make_job_id(conversation_token, conversation_name, hour, minute)
+                if jobs.get_job(new_job_hash) is not None:
                     BOT.send_message(
-                        f"```Skip - A {os.environ['APP_DISPLAY_NAME']} job already exists at {job_hour}:{job_minute}:00 for"
-                        f" '{conversation_name}'```",
+                        f"```Skip - A {os.environ['APP_DISPLAY_NAME']} job already exists at {hour:02}:{minute:02}:00"
+                        f" for '{conversation_name}'```",
                         message,
                     )
                     return
@@ -495,14 +478,7 @@ def handle_command(message: talk_bot.TalkBotMessage):
                 #
                 ##########
 
-                scheduler.add_job(
-                    lambda: sched_process_request(message=message, job_hash=job_hash),
-                    "cron",
-                    hour=hour,
-                    minute=minute,
-                    day_of_week="*",
-                    id=job_hash,
-                )
+                job_hash = jobs.add_job(conversation_token, conversation_name, hour, minute, sched_process_request)
                 if hour <= 9:
                     hour = f"0{hour}"
                 if minute <= 9:
@@ -516,26 +492,9 @@ def handle_command(message: talk_bot.TalkBotMessage):
                 error_handler("Error occured while adding the job", message)
 
         elif param == "list":
-            jobs = scheduler.get_jobs()
             job_list = []
-            for idx, job in enumerate(jobs):
-                logging.info("Job ID: %s, Next Run Time: %s", job.id, job.next_run_time)
-                trigger = job.trigger
-
-                job_hour = int(f"{trigger.fields[trigger.FIELD_NAMES.index('hour')].expressions[0]}")
-                if job_hour <= 9:
-                    job_hour = f"0{job_hour}"
-
-                job_minute = int(f"{trigger.fields[trigger.FIELD_NAMES.index('minute')].expressions[0]}")
-                if job_minute <= 9:
-                    job_minute = f"0{job_minute}"
-
-                job_day_of_week = f"{trigger.fields[trigger.FIELD_NAMES.index('day_of_week')].expressions[0]}"
-                if job_day_of_week == "*":
-                    job_day_of_week = "Daily"
-
-                if f"{job.id}".startswith(f"{conversation_token}_"):
-                    job_list.append(f"{idx + 1}. Job ID: {job.id} {job_hour}:{job_minute}:00 {job_day_of_week}")
+            for idx, job in enumerate(jobs.room_jobs(conversation_token)):
+                job_list.append(f"{idx + 1}. Job ID: {job.job_id} {job.hour:02}:{job.minute:02}:00 Daily")
 
             # Check if job_list is empty
             if not job_list:
@@ -569,11 +528,10 @@ def handle_command(message: talk_bot.TalkBotMessage):
             job_deleted = False
 
             if job_id_to_delete.startswith(f"{conversation_token}_"):
-                jobs = scheduler.get_jobs()
-                for job in jobs:
-                    if job.id == job_id_to_delete:
-                        scheduler.remove_job(job_id_to_delete)
-                        job_deleted = True
+                job = jobs.get_job(job_id_to_delete)
+                if job is not None and job.room_id == conversation_token:
+                    jobs.remove_job(job_id_to_delete)
+                    job_deleted = True
             else:
                 BOT.send_message(
                     "```You are not allowed to do that - you need to be member of the room```",
@@ -587,26 +545,129 @@ def handle_command(message: talk_bot.TalkBotMessage):
                     message,
                 )
                 return
+
+        elif param == "about":
+            words = message.object_content["message"].split()[2:]
+            hduration = TOPIC_DEFAULT_DURATION
+            if len(words) > 1 and re.fullmatch(r"(\d+[a-zA-Z]+)+", words[-1]) and TimeLength(words[-1]).result.success:
+                hduration = words.pop()
+            topic = " ".join(words)
+            if not topic:
+                BOT.send_message("```Usage: @summary about <topic> [<duration>]```", message)
+                return
+
+            last_x_duration_process(
+                message,
+                hduration,
+                topic=topic,
+                announcement=f"Creating a summary about '{topic}' from last {hduration} of chat messages",
+            )
+
+        elif param == "retention":
+            try:
+                new_retention = message.object_content["message"].split(" ")[2]
+            except IndexError:
+                new_retention = None
+
+            try:
+                if new_retention == "default":
+                    store.set_room_retention(conversation_token, None)
+                elif new_retention is not None:
+                    timelength_res = TimeLength(new_retention)
+                    if not timelength_res.result.success:
+                        BOT.send_message("```Usage: @summary retention [<duration>|default]```", message)
+                        return
+                    store.set_room_retention(conversation_token, int(timelength_res.to_seconds(max_precision=0)))
+
+                retention_seconds = store.get_room_retention(conversation_token)
+                if retention_seconds is None:
+                    retention_seconds = retention.RETENTION_DAYS * 86400
+                kept = "forever" if retention_seconds <= 0 else f"for {retention_seconds / 86400:g} days"
+                BOT.send_message(f"```Messages of '{conversation_name}' are kept {kept}```", message)
+            except Exception:
+                error_handler("Error occured while changing the retention", message)
+
         else:
             help_message(message, "I am happy to help, these are commands you can use")
             return
 
 
+metrics.Gauge(
+    "summary_bot_lane_active",
+    "Work items being processed by a lane",
+    lambda: [({"lane": SUMMARY_LANE.name}, SUMMARY_LANE.active)],
+)
+metrics.Gauge(
+    "summary_bot_lane_queued",
+    "Work items waiting for a worker of a lane",
+    lambda: [({"lane": SUMMARY_LANE.name}, SUMMARY_LANE.queue_depth)],
+)
+metrics.Gauge(
+    "summary_bot_lane_workers",
+    "Workers of a lane",
+    lambda: [({"lane": SUMMARY_LANE.name}, SUMMARY_LANE.max_workers)],
+)
+metrics.Gauge("summary_bot_ingest_buffered", "Chat messages waiting for the writer", lambda: INGEST_BUFFER.pending)
+metrics.Gauge("summary_bot_tasks_pending", "TaskProcessing tasks waiting for a result", lambda: TASK_TRACKER.pending)
+metrics.Gauge(
+    "summary_bot_tasks_waiting",
+    "Tasks waiting for the concurrency and rate limit",
+    lambda: TASK_TRACKER.limiter.waiting,
+)
+metrics.Gauge("summary_bot_summaries_in_flight", "Summaries being generated", lambda: len(SUMMARIES_IN_FLIGHT))
+metrics.Gauge(
+    "summary_bot_summaries_queued",
+    "Summaries requested by commands waiting for their turn",
+    lambda: SUMMARY_ADMISSION.queued,
+)
+metrics.Gauge("summary_bot_scheduled_jobs", "Scheduled daily summaries", lambda: len(jobs.REGISTRY))
+metrics.Gauge("summary_bot_leader", "1 if this replica runs the scheduled jobs", lambda: int(LEADER.is_leader))
+metrics.Gauge("summary_bot_database_bytes", "Size of the message database including its WAL", store.database_size)
+
+
+if metrics.METRICS:
+
+    @APP.get("/metrics")
+    def metrics_endpoint():
+        return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@APP.post(TASK_WEBHOOK_PATH)
+async def taskprocessing_webhook(
+    _nc: Annotated[AsyncNextcloudApp, Depends(anc_app)],
+    payload: Annotated[dict, Body()],
+):
+    # called by Nextcloud when one of our TaskProcessing tasks is finished
+    task = payload.get("task")
+    if isinstance(task, dict):
+        TASK_TRACKER.notify(task)
+    return Response()
+
+
 @APP.post(f"/{os.environ['APP_ID']}")
 async def summary_bot(
     message: Annotated[talk_bot.TalkBotMessage, Depends(atalk_bot_msg)],
 ):
-    bot_mention_regex = re.compile("^@summary$|^@summary\\s.*", re.IGNORECASE)
     # store the message if its not a command
     if (
         message.message_type != "Create"
         or not message.object_media_type.startswith("text/")
-        or not bot_mention_regex.match(message.object_content["message"].strip())
+        or not BOT_MENTION.match(message.object_content["message"].strip())
     ):
-        executor.submit(store_message, message)
+        if not await store_message(message, datetime.now()):
+            metrics.INGEST_REJECTED.inc()
+            # let Talk know that the message was not taken
+            return Response(status_code=503)
         return Response()
 
-    executor.submit(handle_command, message)
+    try:
+        SUMMARY_LANE.submit(handle_command, message)
+    except LaneFullError:
+        await asyncio.to_thread(
+            BOT.send_message,
+            "```Too many summary requests are being processed right now, please try again later```",
+            message,
+        )
     return Response()
 
 
@@ -0,0 +1,170 @@
+"""Metrics in the Prometheus text format, kept in memory without an extra dependency"""
+
+import bisect
+import os
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+
+METRICS = os.environ.get("METRICS", "1").lower() not in ("0", "false", "no", "off")
+"""Serve the metrics at ``/metrics``"""
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _key(labels: dict) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        return "\n".join(header + self.samples())
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Metric):
+    """A value that is read from ``collect`` on every scrape, either a number or ``(labels, value)`` pairs"""
+
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], float | list[tuple[dict, float]]]):
+        super().__init__(name, documentation)
+        self._collect = collect
+
+    def samples(self) -> list[str]:
+        values = self._collect()
+        if not isinstance(values, list):
+            values = [({}, values)]
+        return [f"{self.name}{_format_labels(_key(labels))} {_format_value(value)}" for labels, value in values]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[LabelKey, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the seconds the ``with`` block takes, also if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts, strict=True):
+                cumulative += count
+                bucket_labels = _format_labels(key, (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+SUMMARY_SECONDS = Histogram("summary_bot_summary_seconds", "Seconds from the request to the posted summary")
+SUMMARY_STAGE_SECONDS = Histogram(
+    "summary_bot_summary_stage_seconds", "Seconds spent in the database and prompt building stages of a summary"
+)
+TASK_SECONDS = Histogram("summary_bot_task_seconds", "Seconds from scheduling a TaskProcessing task to its result")
+TASK_ADMISSION_SECONDS = Histogram(
+    "summary_bot_task_admission_seconds", "Seconds a task waited for the concurrency and rate limit"
+)
+TASK_QUEUE_SECONDS = Histogram(
+    "summary_bot_task_queue_seconds", "Seconds a task waited in the TaskProcessing queue, as reported by Nextcloud"
+)
+TASK_RUN_SECONDS = Histogram("summary_bot_task_run_seconds", "Seconds the provider worked on a task")
+TASK_DETECT_SECONDS = Histogram(
+    "summary_bot_task_detect_seconds", "Seconds between the end of a task and the bot noticing it"
+)
+TASKS = Counter("summary_bot_tasks_total", "Finished TaskProcessing tasks by status")
+TASK_POLLS = Counter("summary_bot_task_polls_total", "Status requests for pending tasks")
+TASK_WEBHOOKS = Counter("summary_bot_task_webhooks_total", "Task notifications received by the webhook")
+TALK_SEND_SECONDS = Histogram("summary_bot_talk_send_seconds", "Seconds to post a bot message to Talk")
+INGEST_MESSAGES = Counter("summary_bot_ingest_messages_total", "Chat messages written to the database")
+INGEST_DROPPED = Counter("summary_bot_ingest_dropped_total", "Chat messages that could not be stored")
+INGEST_REJECTED = Counter(
+    "summary_bot_ingest_rejected_total", "Webhook calls rejected because the ingest buffer was full"
+)
+INGEST_FLUSH_SECONDS = Histogram("summary_bot_ingest_flush_seconds", "Seconds to write one batch of chat messages")
+INGEST_SPOOL_SYNC_SECONDS = Histogram(
+    "summary_bot_ingest_spool_sync_seconds", "Seconds to sync one group of spooled chat messages to disk"
+)
+SUMMARIES_REJECTED = Counter(
+    "summary_bot_summaries_rejected_total", "Summary commands turned down by the admission control, by reason"
+)
+DIGEST_ROOMS = Counter(
+    "summary_bot_digest_rooms_total", "Rooms of scheduled summaries, skipped without new messages, batched or single"
+)
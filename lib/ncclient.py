@@ -0,0 +1,119 @@
+"""Shared Nextcloud clients with connection reuse, timeouts and retries"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+
+import niquests
+from nc_py_api import AsyncNextcloud, NextcloudException, options, talk_bot
+from niquests.packages.urllib3.util.retry import Retry
+
+from metrics import TALK_SEND_SECONDS
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+NC_TIMEOUT = int(os.environ.get("NC_TIMEOUT", "30"))
+"""Seconds to wait for a response of Nextcloud"""
+
+NC_RETRIES = int(os.environ.get("NC_RETRIES", "2"))
+"""Retries of a failed request, requests that may have reached Nextcloud are only retried if they are idempotent"""
+
+NC_RETRY_BACKOFF = float(os.environ.get("NC_RETRY_BACKOFF", "0.5"))
+"""Seconds before the first retry, doubled for every further retry"""
+
+NC_POOL_SIZE = int(os.environ.get("NC_POOL_SIZE", "10"))
+"""Keep-alive connections of the shared Talk bot session"""
+
+# Nextcloud did not take the request at all, so it is safe to send it again
+_REJECTED_STATUS_CODES = (429, 503)
+
+
+def create_async_client() -> AsyncNextcloud:
+    """A client for one event loop, it keeps its connections alive between requests"""
+    return AsyncNextcloud(npa_timeout=NC_TIMEOUT)
+
+
+async def aocs(nc: AsyncNextcloud, method: str, path: str, **kwargs):
+    """``nc.ocs`` with retries, GET requests are retried on every transient error, others only if not processed"""
+    for attempt in range(NC_RETRIES + 1):
+        try:
+            return await nc.ocs(method, path, **kwargs)
+        except NextcloudException as e:
+            if attempt == NC_RETRIES or (
+                e.status_code not in _REJECTED_STATUS_CODES and (method != "GET" or e.status_code < 500)
+            ):
+                raise
+            error = e
+        except (niquests.exceptions.ConnectionError, niquests.exceptions.Timeout) as e:
+            if attempt == NC_RETRIES or (method != "GET" and not isinstance(e, niquests.exceptions.ConnectTimeout)):
+                raise
+            error = e
+        logger.debug("Retrying %s %s after: %s", method, path, error)
+        await asyncio.sleep(NC_RETRY_BACKOFF * 2**attempt)
+    raise AssertionError("unreachable")
+
+
+def _nextcloud_url() -> str:
+    return os.environ["NEXTCLOUD_URL"].removesuffix("/index.php").removesuffix("/")
+
+
+class PooledTalkBot(talk_bot.TalkBot):
+    """TalkBot that sends through one shared keep-alive session instead of opening a new one for every message.
+
+    Only ``_sign_send_request`` is replaced, the signing follows the upstream implementation.
+    """
+
+    def __init__(self, callback_url: str, display_name: str, description: str = ""):
+        super().__init__(callback_url, display_name, description)
+        self._session: niquests.Session | None = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self) -> niquests.Session:
+        with self._session_lock:
+            if self._session is None:
+                retries = Retry(
+                    total=NC_RETRIES,
+                    connect=NC_RETRIES,
+                    # a message that may have reached Talk is not sent twice
+                    read=0,
+                    other=0,
+                    status=NC_RETRIES,
+                    status_forcelist=_REJECTED_STATUS_CODES,
+                    allowed_methods=None,
+                    backoff_factor=NC_RETRY_BACKOFF,
+                    raise_on_status=False,
+                )
+                self._session = niquests.Session(
+                    retries=retries, pool_connections=1, pool_maxsize=NC_POOL_SIZE, timeout=NC_TIMEOUT
+                )
+                self._session.verify = options.NPA_NC_CERT
+            return self._session
+
+    def _sign_send_request(self, method: str, url_suffix: str, data: dict, data_to_sign: str) -> niquests.Response:
+        secret = talk_bot.get_bot_secret(self.callback_url)
+        if secret is None:
+            raise RuntimeError("Can't find the 'secret' of the bot. Has the bot been installed?")
+        talk_bot_random = secrets.token_hex(16)
+        hmac_sign = hmac.new(secret, talk_bot_random.encode("UTF-8"), digestmod=hashlib.sha256)
+        hmac_sign.update(data_to_sign.encode("UTF-8"))
+        with TALK_SEND_SECONDS.time():
+            return self._get_session().request(
+                method,
+                url=_nextcloud_url() + "/ocs/v2.php/apps/spreed/api/v1/bot" + url_suffix,
+                json=data,
+                headers={
+                    "X-Nextcloud-Talk-Bot-Random": talk_bot_random,
+                    "X-Nextcloud-Talk-Bot-Signature": hmac_sign.hexdigest(),
+                    "OCS-APIRequest": "true",
+                },
+            )
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -0,0 +1,113 @@
+"""Pacing of TaskProcessing tasks, so bursts of scheduled summaries neither flood the LLM provider nor delay commands"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+INTERACTIVE = 0
+SCHEDULED = 1
+
+PRIORITY: ContextVar[int] = ContextVar("priority", default=INTERACTIVE)
+"""Priority of the summary running in the current task, lower values are served first"""
+
+TASK_CONCURRENCY = int(os.environ.get("TASK_CONCURRENCY", "16"))
+"""TaskProcessing tasks of all rooms that may be pending at the same time, 0 disables the limit"""
+
+TASK_RATE_LIMIT = float(os.environ.get("TASK_RATE_LIMIT", "60"))
+"""TaskProcessing tasks that may be scheduled per minute, 0 disables the limit"""
+
+TASK_RATE_BURST = int(os.environ.get("TASK_RATE_BURST", "10"))
+"""Tasks that may be scheduled at once before ``TASK_RATE_LIMIT`` applies"""
+
+SCHEDULE_CONCURRENCY = int(os.environ.get("SCHEDULE_CONCURRENCY", "4"))
+"""Scheduled summaries that may be generated at the same time"""
+
+
+class PriorityLimiter:
+    """Limits concurrency and rate of some work, waiting callers are admitted in order of priority and arrival.
+
+    It is not thread-safe, all callers have to run on the same event loop.
+    """
+
+    def __init__(self, concurrency: int, rate_per_minute: float, burst: int):
+        self.concurrency = concurrency
+        self.rate = rate_per_minute / 60
+        self.burst = max(1, burst)
+        self.active = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._admit()
+
+    async def _acquire(self, priority: int):
+        if not self._waiters and self._can_admit():
+            self._take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._admit()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # admitted in the same moment, hand the slot on
+                self.active -= 1
+                self._admit()
+            raise
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _can_admit(self) -> bool:
+        if self.concurrency > 0 and self.active >= self.concurrency:
+            return False
+        if self.rate > 0:
+            self._refill()
+            return self._tokens >= 1
+        return True
+
+    def _take(self):
+        self.active += 1
+        if self.rate > 0:
+            self._tokens -= 1
+
+    def _admit(self):
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        while self._waiters and self._can_admit():
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._take()
+                future.set_result(None)
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # waiting only for the rate limit, nothing else would wake them up
+        if self._waiters and self.rate > 0 and (self.concurrency <= 0 or self.active < self.concurrency):
+            delay = (1 - self._tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(max(delay, 0.001), self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._admit()
@@ -0,0 +1,120 @@
+"""Deletion of expired chat messages and compaction of the message database"""
+
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import jobs
+import store
+from ingest import INGEST_BUFFER
+from leader import LEADER
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+RETENTION_DAYS = float(os.environ.get("RETENTION_DAYS", "0"))
+"""Days messages are kept for summaries, rooms can set their own value, 0 keeps messages forever"""
+
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", "3600"))
+"""Seconds between two runs of the retention job"""
+
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "1000"))
+"""Messages deleted per transaction, small batches keep the write lock short for the ingest writer"""
+
+RETENTION_BATCH_PAUSE = float(os.environ.get("RETENTION_BATCH_PAUSE", "0.05"))
+"""Seconds to wait between two batches"""
+
+VACUUM_PAGES = int(os.environ.get("VACUUM_PAGES", "2000"))
+"""Free pages given back to the file system per run of the retention job"""
+
+RETENTION_JOB_ID = "retention"
+
+
+def _cutoff(retention_seconds: float, now: datetime) -> str:
+    return (now - timedelta(seconds=retention_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _delete_before(room_id: str, before: str) -> int:
+    deleted = 0
+    while True:
+        count = store.delete_messages_before(room_id, before, RETENTION_BATCH_SIZE)
+        deleted += count
+        if count < RETENTION_BATCH_SIZE:
+            break
+        time.sleep(RETENTION_BATCH_PAUSE)
+    store.delete_cached_summaries_before(room_id, before)
+    return deleted
+
+
+def _drop_expired_partitions(cutoffs: dict[str, str | None], now: datetime) -> int:
+    """Drops the partitions in which the messages of every room have expired, the quickest way to delete them"""
+    dropped = 0
+    now_epoch = store.to_epoch(now)
+    for partition in store.partitions(until=now_epoch):
+        if partition.end > now_epoch:
+            break
+        rooms = store.room_ids(partition)
+        # rooms that got their first message in the meantime have no cutoff yet
+        if all(cutoffs.get(room) and store.to_epoch(cutoffs[room]) >= partition.end for room in rooms):
+            store.drop_partition(partition)
+            dropped += 1
+    return dropped
+
+
+def prune():
+    """Deletes the expired messages of all rooms, then gives free pages back and refreshes the query planner stats.
+
+    Partitions that only hold expired messages are dropped, expired messages in the others are deleted in batches.
+    """
+    if not LEADER.is_leader:
+        return
+    now = datetime.now()
+    room_retentions = store.get_room_retentions()
+    cutoffs = {}
+    for room_id in store.room_ids():
+        retention_seconds = room_retentions.get(room_id, RETENTION_DAYS * 86400)
+        cutoffs[room_id] = _cutoff(retention_seconds, now) if retention_seconds > 0 else None
+    dropped = _drop_expired_partitions(cutoffs, now)
+    deleted = 0
+    for room_id, cutoff in cutoffs.items():
+        if cutoff is not None:
+            deleted += _delete_before(room_id, cutoff)
+    if dropped:
+        logger.info("Dropped %s partitions of expired messages", dropped)
+    if deleted:
+        logger.info("Deleted %s expired messages", deleted)
+    compact()
+
+
+def compact():
+    if not store.SQLITE:
+        # PostgreSQL reclaims space with autovacuum
+        return
+    if store.db.execute_sql("PRAGMA auto_vacuum").fetchone()[0] == 2:  # incremental
+        store.db.execute_sql(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+    elif store.db.execute_sql("PRAGMA freelist_count").fetchone()[0] > VACUUM_PAGES:
+        logger.info("The message database has free pages that are only given back by running VACUUM once")
+    store.db.execute_sql("PRAGMA optimize")
+
+
+def forget_room(room_id: str, left_at: datetime):
+    """Deletes everything stored for a room the bot was removed from"""
+    for job in jobs.room_jobs(room_id):
+        jobs.remove_job(job.job_id)
+    # buffered messages of the room would be written after the delete
+    INGEST_BUFFER.drain()
+    # messages of a later join are kept
+    deleted = _delete_before(room_id, (left_at + timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S"))
+    store.delete_room_settings(room_id)
+    logger.info("Deleted %s messages of room %s after the bot was removed", deleted, room_id)
+
+
+def start():
+    jobs.scheduler.add_job(
+        prune,
+        "interval",
+        seconds=RETENTION_INTERVAL,
+        id=RETENTION_JOB_ID,
+        next_run_time=datetime.now() + timedelta(seconds=60),
+        replace_existing=True,
+    )
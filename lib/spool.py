@@ -0,0 +1,260 @@
+"""Append-only spool file that makes incoming chat messages durable before the webhook is acknowledged"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterator
+
+from metrics import INGEST_SPOOL_SYNC_SECONDS
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+# seconds before a failed sync is tried again
+_RETRY_DELAY = 1.0
+
+Position = tuple[int, int]
+"""Segment number and the offset behind a record, positions grow with every appended record"""
+
+
+def _segment_number(name: str) -> int | None:
+    stem, _, suffix = name.partition(".")
+    return int(stem) if suffix == "spool" and stem.isdigit() else None
+
+
+class Spool:
+    """Messages are appended as JSON lines to numbered segment files, one thread syncs them to disk in groups.
+
+    ``append`` only writes to the page cache, ``synced`` waits for the next ``fsync``, which covers every record
+    appended until then. The sync thread also creates the next segment ahead of time, so ``append`` switches to it
+    without touching the file system. A segment may grow past ``segment_bytes`` until that is done. Segments are
+    deleted by ``release`` once the database holds all of their records, whatever
+    is left on startup is read back by ``replay``.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int, sync_interval_ms: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync_interval = sync_interval_ms / 1000
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(number for number in map(_segment_number, os.listdir(directory)) if number is not None)
+        lock = threading.Lock()
+        self._cond = threading.Condition(lock)
+        # notified when a sync was tried, for the writer waiting in ``settle``
+        self._tried_cond = threading.Condition(lock)
+        self._fd: int | None = None
+        # created by the sync thread for the next roll-over
+        self._next_fd: int | None = None
+        self._segment = 0
+        self._offset = 0
+        self._retired: list[int] = []
+        self._written: Position = (0, 0)
+        self._synced: Position = (0, 0)
+        self._tried: Position = (0, 0)
+        self._unsynced: list[Position] = []
+        self._waiters: list[tuple[Position, asyncio.Future]] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="ingest-spool", daemon=True)
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:012}.spool")
+
+    def replay(self, checkpoint: Position | None) -> Iterator[tuple[dict, Position]]:
+        """Records left from the last run that were not stored yet, in the order they were appended"""
+        for segment in list(self._segments):
+            if checkpoint and segment < checkpoint[0]:
+                continue
+            with open(self._path(segment), "rb") as file:
+                data = file.read()
+            offset = 0
+            while offset < len(data):
+                end = data.find(b"\n", offset)
+                if end < 0:
+                    logger.warning("Ignoring an incomplete record at the end of spool segment %s", segment)
+                    break
+                line, offset = data[offset:end], end + 1
+                if checkpoint and (segment, offset) <= checkpoint:
+                    continue
+                try:
+                    yield json.loads(line), (segment, offset)
+                except ValueError:
+                    logger.warning("Ignoring an unreadable record in spool segment %s", segment)
+
+    def open(self, checkpoint: Position | None):
+        """Starts a new segment after all existing ones, call after ``replay``"""
+        self._segment = max([*self._segments, checkpoint[0] if checkpoint else 0]) + 1
+        self._fd = self._create(self._segment)
+        self._segments.append(self._segment)
+        with self._cond:
+            self._written = self._synced = self._tried = (self._segment, 0)
+            self._tried_cond.notify_all()
+        self._thread.start()
+
+    def _create(self, segment: int) -> int:
+        fd = os.open(self._path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        # the new file name has to be durable as well
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        return fd
+
+    def append(self, row: dict) -> Position:
+        """Writes one record without waiting for the disk
+
+        :raises OSError: if the record could not be written
+        """
+        data = (json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+        with self._cond:
+            if self._offset >= self.segment_bytes and self._next_fd is not None:
+                self._retired.append(self._fd)
+                self._segment += 1
+                self._fd, self._next_fd = self._next_fd, None
+                self._segments.append(self._segment)
+                self._offset = 0
+            written = 0
+            while written < len(data):
+                written += os.write(self._fd, data[written:])
+            self._offset += len(data)
+            self._written = (self._segment, self._offset)
+            self._cond.notify()
+            return self._written
+
+    async def synced(self, position: Position):
+        """Waits until the record at ``position`` is on disk
+
+        :raises OSError: if the spool could not be synced to disk
+        """
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if position <= self._synced:
+                return
+            future = loop.create_future()
+            self._loop = loop
+            self._waiters.append((position, future))
+        await future
+
+    def settle(self, position: Position) -> list[Position]:
+        """Waits until the sync of the records up to ``position`` was tried, returns those it failed for.
+
+        Their webhooks were answered with an error, so the writer leaves them out and the sender delivers them again.
+        """
+        with self._tried_cond:
+            # a waiter that came after the sync started is decided by the next one
+            while not self._closing and (
+                self._tried < position or any(waiting <= position for waiting, _ in self._waiters)
+            ):
+                self._tried_cond.wait()
+            failed = [failed for failed in self._unsynced if failed <= position]
+            self._unsynced = [failed for failed in self._unsynced if failed > position]
+        return failed
+
+    def release(self, position: Position):
+        """Deletes the segments before the one of ``position``, the database holds all of their records"""
+        with self._cond:
+            done = [segment for segment in self._segments if segment < position[0]]
+            self._segments = [segment for segment in self._segments if segment >= position[0]]
+        for segment in done:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self._path(segment))
+
+    def close(self):
+        """Syncs what is left and stops the sync thread"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+        for fd in self._retired:
+            os.close(fd)
+        self._retired = []
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._next_fd is not None:
+            os.close(self._next_fd)
+            self._next_fd = None
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self._path(self._segment + 1))
+
+    def _prepare_next(self):
+        with self._cond:
+            if self._next_fd is not None or self._closing:
+                return
+            segment = self._segment + 1
+        try:
+            fd = self._create(segment)
+        except OSError:
+            # the current segment grows until the next try
+            logger.exception("Could not create the next ingest spool segment")
+            return
+        with self._cond:
+            self._next_fd = fd
+
+    def _run(self):
+        while True:
+            self._prepare_next()
+            with self._cond:
+                while not self._closing and self._written <= self._synced:
+                    self._cond.wait()
+                if self._written <= self._synced:
+                    return
+            if self.sync_interval and not self._closing:
+                # gather the records of concurrent webhooks into one sync
+                time.sleep(self.sync_interval)
+            with self._cond:
+                target = self._written
+                fd = self._fd
+                retired, self._retired = self._retired, []
+            error = self._sync(fd, retired)
+            with self._cond:
+                if error is None:
+                    self._synced = target
+                else:
+                    self._unsynced.extend(position for position, _ in self._waiters if position <= target)
+                self._tried = target
+                self._tried_cond.notify_all()
+                ready = [future for position, future in self._waiters if position <= target]
+                self._waiters = [(position, future) for position, future in self._waiters if position > target]
+                loop = self._loop
+            if ready and loop is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve, ready, error)
+            if error is not None:
+                if self._closing:
+                    return
+                # the next records try again, without spinning on a failing disk
+                time.sleep(_RETRY_DELAY)
+
+    def _sync(self, fd: int, retired: list[int]) -> OSError | None:
+        """Syncs the full segments before the current one, then the current one.
+
+        A full segment is closed once it is synced, the ones that could not be synced are tried again by the next call.
+        """
+        try:
+            with INGEST_SPOOL_SYNC_SECONDS.time():
+                while retired:
+                    os.fsync(retired[0])
+                    os.close(retired.pop(0))
+                os.fsync(fd)
+        except OSError as e:
+            # the records only exist in memory, their webhooks are answered with an error
+            logger.exception("Could not sync the ingest spool to disk")
+            with self._cond:
+                self._retired[:0] = retired
+            return e
+        return None
+
+
+def _resolve(futures: list[asyncio.Future], error: OSError | None):
+    for future in futures:
+        if future.done():
+            continue
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
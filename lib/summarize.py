@@ -0,0 +1,606 @@
+"""Prompt building and summary generation through Nextcloud TaskProcessing"""
+
+import asyncio
+import html
+import logging
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+
+import store
+import tokens
+from chatlog import ChatLog, ChatLogFormat
+from metrics import SUMMARY_STAGE_SECONDS
+from taskproc import TASK_TRACKER, TASK_TYPES
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+
+SUMMARY_TEMPLATE = """You are a secretary and tasked with providing an insightful and succint summarization of a chat log.
+{format_description}
+
+Here is the chat log from the room called "{conversation_name}" that you should summarize, do not mention the room explicitly:
+
+'''
+{messages}
+'''
+
+
+Now, please provide an insighful summary of the provided chat log and use human-readable time references for time related information.
+Use bullet points to list the most important facts and keep the summary concise and readable in roughly 30 seconds.
+"""  # noqa: E501
+
+CHUNK_TEMPLATE = """You are a secretary and tasked with summarizing one part of a longer chat log.
+{format_description}
+
+Here is part {part} of {parts} of the chat log from the room called "{conversation_name}", do not mention the room explicitly:
+
+'''
+{messages}
+'''
+
+
+Now, please list the important facts, decisions, open questions and who was involved as bullet points.
+Keep the date and time of every important event, as your notes will later be merged with the notes of the other parts.
+"""  # noqa: E501
+
+REDUCE_TEMPLATE = """You are a secretary and tasked with providing an insightful and succint summarization of a chat log.
+The chat log was too long to be read at once, so it was split into consecutive parts which were summarized one by one.
+The summaries of the parts will be provided to you below inside triple single quotes, the oldest part first.
+Each part will be encapsulated in a <part> tag, with the following subtags:
+<from> for the timestamp of the first message of the part
+<to> for the timestamp of the last message of the part
+<sum> for the summary of the part
+
+Here are the summaries of the chat log from the room called "{conversation_name}" that you should combine, do not mention the room explicitly:
+
+'''
+{summaries}
+'''
+
+
+Now, please provide one insighful summary of the whole chat log and use human-readable time references for time related information.
+Use bullet points to list the most important facts and keep the summary concise and readable in roughly 30 seconds.
+"""  # noqa: E501
+
+TOPIC_TEMPLATE = """You are a secretary and tasked with providing an insightful and succint summarization of everything a chat log says about one topic.
+{format_description}
+
+Here are the messages about "{topic}" from the room called "{conversation_name}", do not mention the room explicitly:
+
+'''
+{messages}
+'''
+
+
+Now, please provide an insighful summary of what was said about "{topic}" and use human-readable time references for time related information.
+Use bullet points to list the most important facts, decisions and open questions and keep the summary concise and readable in roughly 30 seconds.
+"""  # noqa: E501
+
+DIGEST_TEMPLATE = """You are a secretary and tasked with providing insightful and succint summaries of the chat logs of several unrelated rooms.
+{format_description}
+The chat log of every room will be encapsulated in a <room> tag, with its number in the n attribute and its name in the name attribute.
+
+Here are the chat logs of {rooms} rooms that you should summarize one by one, do not mention the rooms explicitly:
+
+'''
+{messages}
+'''
+
+
+Now, please provide one insighful summary per room and use human-readable time references for time related information.
+Start the summary of every room with a line that only contains "### Room <n>", followed by the summary of that room alone, and keep the order of the rooms.
+Use bullet points to list the most important facts and keep every summary concise and readable in roughly 30 seconds.
+"""  # noqa: E501
+
+DIGEST_HEADING = re.compile(r"^[ \t]*#{1,6}[ \t]*Room[ \t]+(\d+)\b.*$", re.IGNORECASE | re.MULTILINE)
+
+TOPIC_SEARCH_LIMIT = int(os.environ.get("TOPIC_SEARCH_LIMIT", "2000"))
+"""Most relevant messages that are considered for a summary about a topic"""
+
+CONTEXT_TOKENS = int(os.environ.get("CONTEXT_TOKENS", "16000"))
+"""Context length of the model, most models (proprietory and local) have an effective context length of at least
+16000 tokens"""
+
+SUMMARY_OUTPUT_TOKENS = int(os.environ.get("SUMMARY_OUTPUT_TOKENS", "0"))
+"""Tokens left for the generated summary, 0 takes the ``max_tokens`` default the provider advertises or 4000, at
+most half of the context"""
+
+SUMMARY_MAX_TASKS = int(os.environ.get("SUMMARY_MAX_TASKS", "8"))
+"""Upper limit of TaskProcessing tasks for one summary, chunk and reduce tasks included.
+With less than 3 tasks the chat log is cut to a single context window as there is no room for a reduce pass."""
+
+SUMMARY_PARALLEL_TASKS = int(os.environ.get("SUMMARY_PARALLEL_TASKS", "4"))
+"""How many tasks of one summary may run at the same time"""
+
+SUMMARY_CACHE_BUCKET = int(os.environ.get("SUMMARY_CACHE_BUCKET", "3600"))
+"""Seconds of chat that are summarized and cached together at least, 0 disables the summary cache.
+Has to divide a day evenly."""
+
+
+@dataclass
+class Segment:
+    """Messages of a room between ``start`` (inclusive) and ``end`` (exclusive, None for up to now)"""
+
+    start: str
+    end: str | None
+    cacheable: bool
+    message_count: int = 0
+    last_message_id: int = 0
+    characters: int = 0
+    summary: str | None = None
+
+
+def _output_tokens(limits: dict[str, int]) -> int:
+    return min(SUMMARY_OUTPUT_TOKENS or limits.get("max_tokens") or 4000, CONTEXT_TOKENS // 2)
+
+
+def prompt_budget(limits: dict[str, int], conversation_name: str) -> int:
+    """Tokens of one prompt that are left for chat messages or partial summaries"""
+    output = _output_tokens(limits)
+    template = max(
+        tokens.count(template.replace("{format_description}", ChatLogFormat.DESCRIPTION))
+        for template in (SUMMARY_TEMPLATE, CHUNK_TEMPLATE, REDUCE_TEMPLATE, TOPIC_TEMPLATE)
+    )
+    return max(CONTEXT_TOKENS - output - template - tokens.count(conversation_name), 1)
+
+
+async def ocs_get_summary(messages_str: str, conversation_name: str) -> str:
+    return await TASK_TRACKER.run_text2text(
+        SUMMARY_TEMPLATE.format(
+            messages=messages_str, conversation_name=conversation_name, format_description=ChatLogFormat.DESCRIPTION
+        )
+    )
+
+
+def get_ctx_chunks(chat_messages, max_chunks: int, budget: int) -> tuple[list[ChatLog], str | None]:
+    """Split messages into chunks of at most ``budget`` tokens each, written in the ``PROMPT_FORMAT``.
+
+    ``chat_messages`` yields ``(timestamp, actor, message)`` tuples, newest first, and is only consumed until
+    ``max_chunks`` chunks are full, so only those messages are counted. The chunks are returned oldest first, the
+    second return is the cut-off datetime of the messages.
+    """
+    chunks = [ChatLogFormat()]
+    cutoff = None
+
+    for timestamp, actor, content in chat_messages:
+        chunk = chunks[-1]
+        cost = chunk.cost(timestamp, actor, content)
+        if chunk.length + cost > budget and len(chunk):
+            if len(chunks) == max_chunks:
+                cutoff = chunk.first_ts
+                break
+            chunk = ChatLogFormat()
+            chunks.append(chunk)
+            cost = chunk.cost(timestamp, actor, content)
+
+        if cost > budget:
+            # a single message too long for the whole window, keep its most recent part
+            content = tokens.truncate(content, budget - (cost - tokens.count(content)), keep_end=True)
+            cost = chunk.cost(timestamp, actor, content)
+        chunk.add(timestamp, actor, content, cost)
+
+    if not len(chunks[0]):
+        return [], None
+
+    chunks.reverse()
+    return chunks, cutoff
+
+
+def get_ctx_limited_messages(chat_messages, budget: int) -> tuple[str, str | None] | None:
+    """Get the last messages that fit into ``budget`` tokens.
+
+    ``chat_messages`` yields ``(timestamp, actor, message)`` tuples, newest first, and is only consumed until the
+    window is full. The second return is the cut-off datetime of the messages.
+    Returns None if there are no messages at all.
+    """
+    chunks, cutoff = get_ctx_chunks(chat_messages, 1, budget)
+    if not chunks:
+        return None
+    return chunks[0].text(), cutoff
+
+
+def format_part(first_ts: str, last_ts: str, summary: str) -> str:
+    return f"<part><from>{first_ts}</from><to>{last_ts}</to><sum>{summary}</sum></part>"
+
+
+def fetch_chunks(
+    room_id: str, since: str, until: str | None, max_chunks: int, budget: int
+) -> tuple[list[ChatLog], str | None]:
+    return get_ctx_chunks(store.iter_messages_newest_first(room_id, since, until), max_chunks, budget)
+
+
+async def _run_parallel(prompts: list[str]) -> list[str]:
+    semaphore = asyncio.Semaphore(SUMMARY_PARALLEL_TASKS)
+
+    async def run(prompt: str) -> str:
+        async with semaphore:
+            return await TASK_TRACKER.run_text2text(prompt)
+
+    return list(await asyncio.gather(*(run(prompt) for prompt in prompts)))
+
+
+async def _stage(stage: str, fn, *args):
+    """Runs a blocking step of a summary in a worker thread and records how long it took"""
+    with SUMMARY_STAGE_SECONDS.time(stage=stage):
+        return await asyncio.to_thread(fn, *args)
+
+
+def _pack_parts(parts: list[tuple[str, str, str]], budget: int) -> list[list[tuple[str, str, str]]]:
+    groups = [[]]
+    length = 0
+    for part in parts:
+        part_length = tokens.count(format_part(*part)) + 1
+        if groups[-1] and length + part_length > budget:
+            groups.append([])
+            length = 0
+        groups[-1].append(part)
+        length += part_length
+    return groups
+
+
+def _format_parts(parts: list[tuple[str, str, str]]) -> str:
+    return "\n".join(format_part(*part) for part in parts)
+
+
+async def reduce_summaries(
+    parts: list[tuple[str, str, str]], conversation_name: str, tasks_left: int, budget: int
+) -> str:
+    """Combine ``(first_ts, last_ts, summary)`` part summaries, oldest first, into the final summary.
+
+    Parts that do not fit into one context window are reduced group-wise first, as long as ``tasks_left`` allows it,
+    after that the remaining parts are shortened to fit. A single part is returned as it is.
+    """
+    if len(parts) == 1:
+        return parts[0][2]
+    while len(groups := _pack_parts(parts, budget)) > 1:
+        if len(groups) + 1 > tasks_left:
+            share = budget // len(parts) - tokens.count(format_part(parts[0][0], parts[0][1], "")) - 1
+            parts = [(first_ts, last_ts, tokens.truncate(summary, share)) for first_ts, last_ts, summary in parts]
+            break
+
+        prompts = [
+            REDUCE_TEMPLATE.format(summaries=_format_parts(group), conversation_name=conversation_name)
+            for group in groups
+        ]
+        tasks_left -= len(prompts)
+        parts = [
+            (group[0][0], group[-1][1], summary)
+            for group, summary in zip(groups, await _run_parallel(prompts), strict=True)
+        ]
+
+    return await TASK_TRACKER.run_text2text(
+        REDUCE_TEMPLATE.format(summaries=_format_parts(parts), conversation_name=conversation_name)
+    )
+
+
+def plan_segments(room_id: str, start_time_str: str, budget: int) -> list[Segment]:
+    """Split the messages of a room since ``start_time_str`` into segments, oldest first.
+
+    Completed buckets of ``SUMMARY_CACHE_BUCKET`` seconds are packed into spans of about ``budget`` tokens. The
+    packing restarts at every midnight, so a span only changes when new messages land in it and its summary can be
+    cached across requests of any duration. Spans that reach back before ``start_time_str`` form the uncached head
+    segment, the still running bucket forms the uncached tail segment.
+    """
+    bucket_size = SUMMARY_CACHE_BUCKET
+    start = store.to_epoch(start_time_str)
+    day_start = start - start % 86400
+    now = store.to_epoch(datetime.now())
+    current_bucket = now - now % bucket_size
+    overhead = ChatLogFormat.MESSAGE_OVERHEAD
+
+    spans: list[Segment] = []
+    tail = Segment(store.format_timestamp(current_bucket), None, cacheable=False)
+    stats = store.bucket_stats(room_id, store.format_timestamp(day_start), bucket_size)
+    for bucket, count, last_id, characters in stats:
+        characters += count * overhead
+        if bucket >= current_bucket:
+            tail.message_count += count
+            tail.characters += characters
+            continue
+
+        span = spans[-1] if spans else None
+        if (
+            span is None
+            or store.to_epoch(span.start) // 86400 != bucket // 86400
+            or tokens.from_characters(span.characters + characters) > budget
+        ):
+            span = Segment(store.format_timestamp(bucket), None, cacheable=True)
+            spans.append(span)
+        span.end = store.format_timestamp(bucket + bucket_size)
+        span.message_count += count
+        span.last_message_id = max(span.last_message_id, last_id)
+        span.characters += characters
+
+    segments = []
+    head = Segment(start_time_str, None, cacheable=False)
+    for span in spans:
+        if store.to_epoch(span.start) < start:
+            head.end = span.end
+            head.characters += span.characters
+        else:
+            segments.append(span)
+    if head.end is not None:
+        segments.insert(0, head)
+    else:
+        tail.start = max(tail.start, start_time_str)
+    if tail.message_count:
+        segments.append(tail)
+    return segments
+
+
+async def summarize_segments(
+    room_id: str, conversation_name: str, start_time_str: str, budget: int
+) -> tuple[str, str | None] | None:
+    """Summarize the messages of a room since ``start_time_str`` from cached partial summaries.
+
+    Only segments without a valid cache entry are summarized, newest first, as long as ``SUMMARY_MAX_TASKS`` allows it.
+    Finished spans are put into the cache before all partial summaries are reduced into the final summary.
+
+    :raises LLMException: if a TaskProcessing task fails
+    """
+    segments = await _stage("plan", plan_segments, room_id, start_time_str, budget)
+    if not segments:
+        return None
+
+    cached = await _stage("cache", store.get_cached_summaries, room_id, segments[0].start)
+    tasks_left = SUMMARY_MAX_TASKS - 1
+    selected: list[tuple[Segment, list[ChatLog], bool]] = []
+    cutoff = None
+    for segment in reversed(segments):
+        entry = cached.get((segment.start, segment.end)) if segment.cacheable else None
+        if (
+            entry is not None
+            and entry.message_count == segment.message_count
+            and entry.last_message_id == segment.last_message_id
+        ):
+            segment.summary = entry.summary
+            selected.append((segment, [], False))
+            continue
+
+        if tasks_left == 0:
+            cutoff = selected[-1][0].start if selected else segment.end
+            break
+        chunks, segment_cutoff = await _stage(
+            "fetch", fetch_chunks, room_id, segment.start, segment.end, tasks_left, budget
+        )
+        if not chunks:
+            continue
+        tasks_left -= len(chunks)
+        selected.append((segment, chunks, segment.cacheable and segment_cutoff is None))
+        if segment_cutoff is not None:
+            cutoff = segment_cutoff
+            break
+
+    selected.reverse()
+    chunks = [chunk for _, segment_chunks, _ in selected for chunk in segment_chunks]
+    logger.debug(
+        "Summarizing room %s from %s segments, %s cached, %s chunks to summarize",
+        room_id,
+        len(selected),
+        sum(1 for segment, _, _ in selected if segment.summary is not None),
+        len(chunks),
+    )
+    prompts = [
+        CHUNK_TEMPLATE.format(
+            messages=chunk.text(),
+            part=i + 1,
+            parts=len(chunks),
+            conversation_name=conversation_name,
+            format_description=ChatLogFormat.DESCRIPTION,
+        )
+        for i, chunk in enumerate(chunks)
+    ]
+    summaries = iter(await _run_parallel(prompts))
+
+    parts = []
+    for segment, segment_chunks, cache in selected:
+        if not segment_chunks:
+            parts.append((segment.start, segment.end, segment.summary))
+            continue
+        chunk_parts = [(chunk.first_ts, chunk.last_ts, next(summaries)) for chunk in segment_chunks]
+        segment.summary = "\n".join(summary for _, _, summary in chunk_parts)
+        if cache:
+            await _stage(
+                "cache",
+                store.put_cached_summary,
+                room_id,
+                segment.start,
+                segment.end,
+                segment.message_count,
+                segment.last_message_id,
+                segment.summary,
+            )
+        parts.extend(chunk_parts)
+
+    return await reduce_summaries(parts, conversation_name, tasks_left + 1, budget), cutoff
+
+
+async def summarize_room(room_id: str, conversation_name: str, start_time_str: str) -> tuple[str, str | None] | None:
+    """Summarize the messages of a room since ``start_time_str``.
+
+    Ranges longer than one context window are split into chunks that are summarized in parallel and then reduced into
+    one summary, within the ``SUMMARY_MAX_TASKS`` limit. With the summary cache enabled the chunks are aligned to
+    cached spans, see ``plan_segments``. Ranges that fit into one context window take a single task and do not use
+    the cache, cached spans would still need a reduce pass. The size of a context window is taken from
+    ``prompt_budget``.
+    Returns the summary and the cut-off datetime of the messages, None if there are no messages at all.
+
+    :raises LLMException: if a TaskProcessing task fails
+    """
+    task_type = await asyncio.to_thread(TASK_TYPES.get)
+    budget = prompt_budget(task_type.limits, conversation_name)
+
+    chunks, cutoff = await _stage("fetch", fetch_chunks, room_id, start_time_str, None, 1, budget)
+    if not chunks:
+        return None
+
+    if cutoff is None or SUMMARY_MAX_TASKS < 3:
+        return await ocs_get_summary(chunks[0].text(), conversation_name), cutoff
+
+    if SUMMARY_CACHE_BUCKET:
+        return await summarize_segments(room_id, conversation_name, start_time_str, budget)
+
+    chunks, cutoff = await _stage("fetch", fetch_chunks, room_id, start_time_str, None, SUMMARY_MAX_TASKS - 1, budget)
+
+    logger.debug("Summarizing %s chunks of room %s", len(chunks), room_id)
+    prompts = [
+        CHUNK_TEMPLATE.format(
+            messages=chunk.text(),
+            part=i + 1,
+            parts=len(chunks),
+            conversation_name=conversation_name,
+            format_description=ChatLogFormat.DESCRIPTION,
+        )
+        for i, chunk in enumerate(chunks)
+    ]
+    parts = [
+        (chunk.first_ts, chunk.last_ts, summary)
+        for chunk, summary in zip(chunks, await _run_parallel(prompts), strict=True)
+    ]
+    return await reduce_summaries(parts, conversation_name, SUMMARY_MAX_TASKS - len(chunks), budget), cutoff
+
+
+def topic_words(topic: str) -> list[str]:
+    """Words of ``topic`` to search for, messages containing more of them rank higher"""
+    return re.findall(r"\w+", topic)
+
+
+def select_topic_messages(room_id: str, topic: str, start_time_str: str, budget: int) -> ChatLog | None:
+    """The messages that match ``topic`` best, as many as fit into ``budget`` tokens"""
+    words = topic_words(topic)
+    if not words:
+        return None
+
+    selected = []
+    length = 0
+    for timestamp, actor, content in store.search_messages(room_id, words, start_time_str, TOPIC_SEARCH_LIMIT):
+        length += tokens.from_characters(len(actor) + len(content) + ChatLogFormat.MESSAGE_OVERHEAD)
+        if length > budget and selected:
+            break
+        selected.append((timestamp, actor, content))
+
+    # the estimate is rough, the exact fit is made in the order of the prompt
+    selected.sort(key=lambda row: row[0], reverse=True)
+    chunks, _ = get_ctx_chunks(selected, 1, budget)
+    return chunks[0] if chunks else None
+
+
+async def summarize_topic(room_id: str, conversation_name: str, topic: str, start_time_str: str) -> str | None:
+    """Summarize what was said about ``topic`` in a room since ``start_time_str``.
+
+    Only the messages ranked best by the full-text index are read, so long ranges cost one task.
+    Returns None if no message matches.
+
+    :raises LLMException: if the TaskProcessing task fails
+    """
+    task_type = await asyncio.to_thread(TASK_TYPES.get)
+    budget = prompt_budget(task_type.limits, conversation_name) - tokens.count(topic)
+    chunk = await _stage("search", select_topic_messages, room_id, topic, start_time_str, budget)
+    if chunk is None:
+        return None
+
+    logger.debug("Summarizing %s messages about a topic in room %s", len(chunk), room_id)
+    return await TASK_TRACKER.run_text2text(
+        TOPIC_TEMPLATE.format(
+            messages=chunk.text(),
+            topic=topic,
+            conversation_name=conversation_name,
+            format_description=ChatLogFormat.DESCRIPTION,
+        )
+    )
+
+
+def format_digest_room(number: int, conversation_name: str, messages: str) -> str:
+    # a quote or an angle bracket in the room name would end the attribute or the tag
+    return f'<room n="{number}" name="{html.escape(conversation_name)}">\n{messages}\n</room>'
+
+
+def fetch_digest_logs(rooms: list[tuple[str, str]], start_time_str: str, budget: int) -> list[tuple[str, str, ChatLog]]:
+    """Chat logs of the rooms that are small enough to be summarized together.
+
+    Returns ``(room_id, conversation_name, chat_log)`` of the rooms whose messages since ``start_time_str`` fit into
+    half of ``budget`` tokens, so at least two of them fit into one prompt.
+    """
+    logs = []
+    for room_id, conversation_name in rooms:
+        chunks, cutoff = fetch_chunks(room_id, start_time_str, None, 1, budget // 2)
+        if chunks and cutoff is None:
+            logs.append((room_id, conversation_name, chunks[0]))
+    return logs
+
+
+def pack_digests(
+    logs: list[tuple[str, str, ChatLog]], budget: int, max_rooms: int
+) -> list[list[tuple[str, str, ChatLog]]]:
+    """Packs chat logs into groups of at most ``max_rooms`` that fit into ``budget`` tokens.
+
+    Every log goes into the first group with space left.
+    """
+    groups: list[list[tuple[str, str, ChatLog]]] = []
+    lengths: list[int] = []
+    for log in logs:
+        length = log[2].length + tokens.count(format_digest_room(max_rooms, log[1], "")) + 1
+        for i, group in enumerate(groups):
+            if len(group) < max_rooms and lengths[i] + length <= budget:
+                group.append(log)
+                lengths[i] += length
+                break
+        else:
+            groups.append([log])
+            lengths.append(length)
+    return groups
+
+
+def split_digest(output: str, rooms: int) -> list[str | None]:
+    """The summaries of the ``rooms`` rooms in the output of a digest task, None for a room the model left out"""
+    summaries: list[str | None] = [None] * rooms
+    headings = list(DIGEST_HEADING.finditer(output))
+    for heading, following in zip(headings, [*headings[1:], None], strict=True):
+        number = int(heading.group(1))
+        summary = output[heading.end() : following.start() if following else len(output)].strip()
+        if 1 <= number <= rooms and summary and summaries[number - 1] is None:
+            summaries[number - 1] = summary
+    return summaries
+
+
+async def summarize_digests(rooms: list[tuple[str, str]], start_time_str: str, max_rooms: int) -> dict[str, str]:
+    """Summarize the messages since ``start_time_str`` of several rooms, small rooms are summarized together.
+
+    ``rooms`` are ``(room_id, conversation_name)`` tuples. The chat logs of rooms that fit into half a context window
+    are packed into prompts of up to ``max_rooms`` rooms each, one task answers all rooms of a prompt. Returns the
+    summary of every room that was summarized that way, the others are left to ``summarize_room``.
+
+    :raises LLMException: if a TaskProcessing task fails
+    """
+    task_type = await asyncio.to_thread(TASK_TYPES.get)
+    budget = max(
+        CONTEXT_TOKENS
+        - _output_tokens(task_type.limits)
+        - tokens.count(DIGEST_TEMPLATE.replace("{format_description}", ChatLogFormat.DESCRIPTION)),
+        1,
+    )
+    logs = await _stage("fetch", fetch_digest_logs, rooms, start_time_str, budget)
+    groups = [group for group in pack_digests(logs, budget, max_rooms) if len(group) > 1]
+    if not groups:
+        return {}
+
+    logger.debug("Summarizing %s rooms together in %s tasks", sum(len(group) for group in groups), len(groups))
+    prompts = [
+        DIGEST_TEMPLATE.format(
+            messages="\n".join(
+                format_digest_room(i + 1, conversation_name, chat_log.text())
+                for i, (_, conversation_name, chat_log) in enumerate(group)
+            ),
+            rooms=len(group),
+            format_description=ChatLogFormat.DESCRIPTION,
+        )
+        for group in groups
+    ]
+    summaries = {}
+    for group, output in zip(groups, await _run_parallel(prompts), strict=True):
+        for (room_id, _, _), summary in zip(group, split_digest(output, len(group)), strict=True):
+            if summary is not None:
+                summaries[room_id] = summary
+    return summaries
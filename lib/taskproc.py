@@ -0,0 +1,313 @@
+"""Tracking of Nextcloud TaskProcessing tasks on a single asyncio loop"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+from nc_py_api import AsyncNextcloud
+
+from metrics import (
+    TASK_ADMISSION_SECONDS,
+    TASK_DETECT_SECONDS,
+    TASK_POLLS,
+    TASK_QUEUE_SECONDS,
+    TASK_RUN_SECONDS,
+    TASK_SECONDS,
+    TASK_WEBHOOKS,
+    TASKS,
+)
+from ncclient import aocs, create_async_client
+from pacing import PRIORITY, TASK_CONCURRENCY, TASK_RATE_BURST, TASK_RATE_LIMIT, PriorityLimiter
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+
+class LLMException(Exception):
+    pass
+
+
+TASK_TYPE = "core:text2text"
+
+TASK_TIMEOUT = int(os.environ.get("TASK_TIMEOUT", str(30 * 60)))
+"""Seconds to wait for a task before giving up"""
+
+TASK_POLL_MIN_INTERVAL = float(os.environ.get("TASK_POLL_MIN_INTERVAL", "1"))
+TASK_POLL_MAX_INTERVAL = float(os.environ.get("TASK_POLL_MAX_INTERVAL", "30"))
+"""A task is polled after ``TASK_POLL_MIN_INTERVAL`` seconds first, every further poll waits 1.5 times longer up to
+``TASK_POLL_MAX_INTERVAL`` seconds"""
+
+TASK_POLL_CONCURRENCY = int(os.environ.get("TASK_POLL_CONCURRENCY", "8"))
+"""Status requests that may run at the same time"""
+
+TASK_WEBHOOK = os.environ.get("TASK_WEBHOOK", "1").lower() not in ("0", "false", "no", "off")
+"""Ask Nextcloud to call ``TASK_WEBHOOK_PATH`` when a task finishes, polling is only the safety net then"""
+
+TASK_WEBHOOK_PATH = "/taskprocessing_webhook"
+
+FINAL_STATUSES = ("STATUS_SUCCESSFUL", "STATUS_FAILED", "STATUS_CANCELLED")
+
+TASK_TYPES_TTL = int(os.environ.get("TASK_TYPES_TTL", "300"))
+"""Seconds the list of available task types is trusted, it is refreshed in the background after that"""
+
+TASK_TYPES_NEGATIVE_TTL = int(os.environ.get("TASK_TYPES_NEGATIVE_TTL", "30"))
+"""Seconds a missing task type or a failed lookup is remembered before asking again"""
+
+
+def validate_task_response(response) -> dict:
+    if not isinstance(response, dict) or "task" not in response:
+        raise LLMException("Failed to create Nextcloud TaskProcessing task")
+
+    task = response["task"]
+
+    if not isinstance(task, dict) or "id" not in task or "status" not in task or "output" not in task:
+        raise LLMException("Invalid Nextcloud TaskProcessing task response")
+
+    return task
+
+
+def observe_task(task: dict):
+    """Records the status of a finished task and the times Nextcloud reports for it"""
+    TASKS.inc(status=task["status"])
+    scheduled_at, started_at, ended_at = (task.get(key) for key in ("scheduledAt", "startedAt", "endedAt"))
+    if isinstance(scheduled_at, int) and isinstance(started_at, int) and started_at >= scheduled_at > 0:
+        TASK_QUEUE_SECONDS.observe(started_at - scheduled_at)
+        if isinstance(ended_at, int) and ended_at >= started_at:
+            TASK_RUN_SECONDS.observe(ended_at - started_at)
+    if isinstance(ended_at, int) and ended_at > 0:
+        # whole seconds on another clock, only meaningful in aggregate
+        TASK_DETECT_SECONDS.observe(max(0.0, time.time() - ended_at))
+
+
+def task_output(task: dict) -> str:
+    if task["status"] != "STATUS_SUCCESSFUL":
+        raise LLMException("Nextcloud TaskProcessing Task failed: " + task["status"])
+
+    if not isinstance(task["output"], dict) or "output" not in task["output"]:
+        raise LLMException("No output in Nextcloud TaskProcessing task")
+
+    return task["output"]["output"]
+
+
+@dataclass
+class _PendingTask:
+    future: asyncio.Future
+    deadline: float
+    interval: float
+    next_poll: float
+
+
+class TaskTracker:
+    """Owns all pending TaskProcessing tasks.
+
+    Tasks are awaited on one event loop running in a background thread, so waiting for any number of tasks costs no
+    additional threads. Finished tasks are reported by the TaskProcessing webhook, all pending tasks are also polled
+    in batches with a per-task backoff in case a webhook never arrives. New tasks pass ``limiter`` first, which
+    admits interactive summaries before scheduled ones.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._pending: dict[int, _PendingTask] = {}
+        self._wakeup = asyncio.Event()
+        self._nc: AsyncNextcloud | None = None
+        self.limiter = PriorityLimiter(TASK_CONCURRENCY, TASK_RATE_LIMIT, TASK_RATE_BURST)
+        self._thread = threading.Thread(target=self._run, name="task-tracker", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.create_task(self._poll_loop())
+        self._loop.run_forever()
+
+    def client(self) -> AsyncNextcloud:
+        if self._nc is None:
+            self._nc = create_async_client()
+        return self._nc
+
+    def spawn(self, coro) -> Future:
+        """Runs a coroutine on the tracker loop, may be called from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def run_text2text(self, prompt: str) -> str:
+        """Schedules a text2text task and waits for its output, has to be awaited on the tracker loop
+
+        :raises LLMException: if the task could not be scheduled, failed or timed out
+        """
+        start = time.perf_counter()
+        async with self.limiter.slot(PRIORITY.get()):
+            TASK_ADMISSION_SECONDS.observe(time.perf_counter() - start)
+            with TASK_SECONDS.time():
+                return await self._run_text2text(prompt)
+
+    async def _run_text2text(self, prompt: str) -> str:
+        payload = {"type": TASK_TYPE, "appId": os.environ["APP_ID"], "input": {"input": prompt}}
+        if TASK_WEBHOOK:
+            payload["webhookUri"] = TASK_WEBHOOK_PATH
+            payload["webhookMethod"] = f"AppAPI:{os.environ['APP_ID']}:POST"
+
+        try:
+            response = await aocs(self.client(), "POST", "/ocs/v2.php/taskprocessing/schedule", json=payload)
+        except Exception as e:
+            raise LLMException("Failed to create Nextcloud TaskProcessing task") from e
+        task = validate_task_response(response)
+        logger.debug("Task with ID %s created", task["id"])
+
+        if task["status"] not in FINAL_STATUSES:
+            now = time.monotonic()
+            pending = _PendingTask(
+                future=self._loop.create_future(),
+                deadline=now + TASK_TIMEOUT,
+                interval=TASK_POLL_MIN_INTERVAL,
+                next_poll=now + TASK_POLL_MIN_INTERVAL,
+            )
+            self._pending[task["id"]] = pending
+            self._wakeup.set()
+            try:
+                task = await pending.future
+            finally:
+                self._pending.pop(task["id"], None)
+
+        observe_task(task)
+        return task_output(task)
+
+    def notify(self, task: dict):
+        """Hands a task received by the webhook to the tracker, may be called from any thread"""
+        TASK_WEBHOOKS.inc()
+        self._loop.call_soon_threadsafe(self._on_notify, task)
+
+    def _on_notify(self, task: dict):
+        pending = self._pending.get(task.get("id"))
+        if pending is None or pending.future.done():
+            return
+        if task.get("status") in FINAL_STATUSES and "output" in task:
+            pending.future.set_result(task)
+        else:
+            # incomplete payload, fetch the task right away
+            pending.next_poll = 0
+            self._wakeup.set()
+
+    async def _poll_loop(self):
+        semaphore = asyncio.Semaphore(TASK_POLL_CONCURRENCY)
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            due = [
+                (task_id, pending)
+                for task_id, pending in self._pending.items()
+                if pending.next_poll <= now and not pending.future.done()
+            ]
+            if due:
+                await asyncio.gather(*(self._poll(task_id, pending, semaphore) for task_id, pending in due))
+
+            next_poll = min((pending.next_poll for pending in self._pending.values()), default=None)
+            timeout = None if next_poll is None else max(0.0, next_poll - time.monotonic())
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+
+    async def _poll(self, task_id: int, pending: _PendingTask, semaphore: asyncio.Semaphore):
+        try:
+            async with semaphore:
+                TASK_POLLS.inc()
+                task = validate_task_response(
+                    await aocs(self.client(), "GET", f"/ocs/v2.php/taskprocessing/task/{task_id}")
+                )
+            logger.debug("Task (%s) status: %s", task_id, task["status"])
+            if task["status"] in FINAL_STATUSES:
+                if not pending.future.done():
+                    pending.future.set_result(task)
+                return
+        except Exception:
+            logger.warning("Could not fetch the status of task %s", task_id, exc_info=True)
+
+        now = time.monotonic()
+        if now >= pending.deadline:
+            if not pending.future.done():
+                TASKS.inc(status="timeout")
+                pending.future.set_exception(LLMException(f"Nextcloud TaskProcessing task {task_id} timed out"))
+            return
+        pending.interval = min(pending.interval * 1.5, TASK_POLL_MAX_INTERVAL)
+        pending.next_poll = min(now + pending.interval, pending.deadline)
+
+
+@dataclass
+class TaskTypeInfo:
+    available: bool
+    limits: dict[str, int]
+    """Numeric input defaults the provider advertises for the task type, like ``max_tokens``"""
+    fetched_at: float
+
+
+class TaskTypeCache:
+    """Cached answer of ``/taskprocessing/tasktypes`` for ``TASK_TYPE``.
+
+    A positive answer is served for ``ttl`` seconds, for another ``ttl`` seconds it is still served while a refresh
+    runs in the background, later callers wait for a fresh answer. A negative answer is kept for ``negative_ttl``.
+    """
+
+    def __init__(self, tracker: TaskTracker, ttl: int, negative_ttl: int):
+        self._tracker = tracker
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._info: TaskTypeInfo | None = None
+        self._lock = threading.Lock()
+        self._refreshing: Future | None = None
+
+    def get(self) -> TaskTypeInfo:
+        info = self._info
+        if info is None:
+            return self._refresh().result()
+
+        age = time.monotonic() - info.fetched_at
+        if not info.available:
+            return self._refresh().result() if age >= self.negative_ttl else info
+        if age >= 2 * self.ttl:
+            return self._refresh().result()
+        if age >= self.ttl:
+            self._refresh()
+        return info
+
+    def _refresh(self) -> Future:
+        # concurrent callers share one request
+        with self._lock:
+            if self._refreshing is None or self._refreshing.done():
+                self._refreshing = self._tracker.spawn(self._fetch())
+            return self._refreshing
+
+    async def _fetch(self) -> TaskTypeInfo:
+        try:
+            result = await aocs(self._tracker.client(), "GET", "/ocs/v2.php/taskprocessing/tasktypes")
+        except Exception:
+            logger.exception("An error occurred while fetching the list of available tasktypes")
+            result = None
+
+        task_type = result.get("types", {}).get(TASK_TYPE) if isinstance(result, dict) else None
+        if isinstance(task_type, dict):
+            info = TaskTypeInfo(True, _advertised_limits(task_type), time.monotonic())
+        else:
+            if result is not None:
+                logger.error("The neccessary task type: %s is not available", TASK_TYPE)
+            info = TaskTypeInfo(False, {}, time.monotonic())
+        self._info = info
+        return info
+
+
+def _advertised_limits(task_type: dict) -> dict[str, int]:
+    limits = {}
+    for key in ("inputShapeDefaults", "optionalInputShapeDefaults"):
+        defaults = task_type.get(key)
+        if isinstance(defaults, dict):
+            limits.update({name: value for name, value in defaults.items() if isinstance(value, int)})
+    return limits
+
+
+TASK_TRACKER = TaskTracker()
+TASK_TYPES = TaskTypeCache(TASK_TRACKER, TASK_TYPES_TTL, TASK_TYPES_NEGATIVE_TTL)
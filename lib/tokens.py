@@ -0,0 +1,103 @@
+"""Token counting for prompt budgets, estimated locally or exact with the optional tiktoken package"""
+
+import logging
+import math
+import os
+import re
+from typing import Protocol
+
+logger = logging.getLogger(os.environ["APP_ID"])
+
+TOKENIZER = os.environ.get("TOKENIZER", "")
+"""tiktoken encoding used to count tokens exactly, like ``cl100k_base``, the local estimate is used if empty"""
+
+TOKEN_ESTIMATE_MARGIN = float(os.environ.get("TOKEN_ESTIMATE_MARGIN", "1.1"))
+"""Factor the local estimate is raised by, to stay below the limit for tokenizers that split text more finely"""
+
+CHARACTERS_PER_TOKEN = 3
+"""Conservative average for places where only the length of a text is known"""
+
+# ASCII words, groups of up to three digits (as most tokenizers split numbers), runs of ASCII punctuation, runs of
+# Latin, Greek and Cyrillic letters outside ASCII, any other single character except whitespace
+_PIECES = re.compile(r"[A-Za-z]+|[0-9]{1,3}|[!-/:-@\[-`{-~]+|[\u0080-\u052f]+|\S")
+
+
+class Tokenizer(Protocol):
+    def count(self, text: str) -> int: ...
+
+
+class EstimatingTokenizer:
+    """Estimates the tokens of a BPE tokenizer from character classes without any vocabulary.
+
+    ASCII words cost one token per five letters, punctuation and letters of other European scripts one per two
+    characters, digits one per group of three, other characters like CJK one each.
+    """
+
+    def __init__(self, margin: float):
+        self.margin = margin
+
+    def count(self, text: str) -> int:
+        tokens = 0
+        for piece in _PIECES.findall(text):
+            first = piece[0]
+            if first.isascii() and first.isalpha():
+                tokens += (len(piece) + 4) // 5
+            elif (first.isascii() and not first.isdigit()) or "\u0080" <= first <= "\u052f":
+                tokens += (len(piece) + 1) // 2
+            else:
+                tokens += 1
+        return math.ceil(tokens * self.margin)
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding_name: str):
+        import tiktoken
+
+        self._encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+def _create_tokenizer() -> Tokenizer:
+    if TOKENIZER:
+        try:
+            return TiktokenTokenizer(TOKENIZER)
+        except Exception:
+            logger.warning("Tokenizer %s is not available, tokens are estimated instead", TOKENIZER, exc_info=True)
+    return EstimatingTokenizer(TOKEN_ESTIMATE_MARGIN)
+
+
+_tokenizer = _create_tokenizer()
+
+
+def count(text: str) -> int:
+    return _tokenizer.count(text)
+
+
+def from_characters(characters: int) -> int:
+    """Token estimate for a text of which only the length is known"""
+    return math.ceil(characters / CHARACTERS_PER_TOKEN)
+
+
+def truncate(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Shortens ``text`` to at most ``max_tokens`` tokens, keeping its beginning or its end.
+
+    The cut is found by bisecting on the length, so the text is counted only a logarithmic number of times.
+    """
+    if max_tokens <= 0:
+        return ""
+    if count(text) <= max_tokens:
+        return text
+
+    def cut(length: int) -> str:
+        return text[len(text) - length :] if keep_end else text[:length]
+
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count(cut(middle)) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return cut(low)
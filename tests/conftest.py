@@ -0,0 +1,10 @@
+"""The modules of the app are imported from ``lib``, the way the container runs them"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+
+os.environ.setdefault("APP_ID", "summary_bot")
+os.environ.setdefault("APP_PERSISTENT_STORAGE", tempfile.mkdtemp(prefix="summary_bot_tests_"))
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionError, SummaryAdmission
+
+
+def make_admission(concurrency=1, max_queued=10, room_pending=3) -> SummaryAdmission:
+    return SummaryAdmission(concurrency, max_queued, room_pending, 0, 1, 0, 1, 31)
+
+
+def test_positions_follow_the_rounds_of_the_fair_queue():
+    admission = make_admission()
+    running = admission.admit("a", 3600)
+    assert running.granted
+    assert running.position == 0
+
+    a1 = admission.admit("a", 3600)
+    a2 = admission.admit("a", 3600)
+    b1 = admission.admit("b", 3600)
+    c1 = admission.admit("c", 3600)
+    b2 = admission.admit("b", 3600)
+    # served as a1, b1, c1 in the first round and a2, b2 in the second, a2 was second when it was admitted
+    assert [t.position for t in (a1, a2, b1, c1, b2)] == [1, 2, 2, 3, 5]
+    assert admission.queued == 5
+
+
+def test_queued_summaries_are_granted_one_conversation_at_a_time():
+    admission = make_admission()
+    running = admission.admit("a", 3600)
+    tickets = {name: admission.admit(name[0], 3600) for name in ("a1", "a2", "b1", "c1", "b2")}
+    order = []
+
+    async def summarize(name):
+        await admission.wait(tickets[name])
+        order.append(name)
+        await asyncio.sleep(0)
+        admission.release(tickets[name])
+
+    async def main():
+        tasks = [asyncio.create_task(summarize(name)) for name in tickets]
+        await asyncio.sleep(0)
+        admission.release(running)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["a1", "b1", "c1", "a2", "b2"]
+    assert admission.running == 0
+    assert admission.queued == 0
+
+
+def test_abandoned_ticket_leaves_the_queue():
+    admission = make_admission()
+    running = admission.admit("a", 3600)
+    b1 = admission.admit("b", 3600)
+    c1 = admission.admit("c", 3600)
+    admission.release(b1)
+    admission.release(running)
+    assert c1.granted
+    assert not b1.granted
+    assert admission.queued == 0
+
+
+@pytest.mark.parametrize(
+    ("room_id", "duration", "reason"),
+    [("a", 3600, "room_pending"), ("d", 3600, "queue_full"), ("d", 40 * 86400, "duration")],
+)
+def test_requests_are_turned_down(room_id, duration, reason):
+    admission = make_admission(max_queued=2, room_pending=2)
+    admission.admit("a", 3600)
+    admission.admit("a", 3600)
+    admission.admit("b", 3600)
+    with pytest.raises(AdmissionError) as error:
+        admission.admit(room_id, duration)
+    assert error.value.reason == reason
+
+
+def test_room_rate_limit():
+    admission = SummaryAdmission(8, 10, 10, 6, 2, 0, 1, 31)
+    admission.admit("a", 3600)
+    admission.admit("a", 3600)
+    with pytest.raises(AdmissionError) as error:
+        admission.admit("a", 3600)
+    assert error.value.reason == "rate_limited"
+    admission.admit("b", 3600)
@@ -0,0 +1,51 @@
+import tokens
+from chatlog import CompactChatLog
+
+# newest first, the way chat logs are filled
+ROWS = [
+    ("2024-05-02 09:01:30", "Bob", "see you"),
+    ("2024-05-02 09:01:10", "Bob", "ok then"),
+    ("2024-05-02 09:00:40", "Alice", "lunch at noon?"),
+    ("2024-05-01 17:45:00", "Alice", "the build is green"),
+    ("2024-05-01 17:44:00", "Carol", "is the build fixed"),
+]
+
+
+def fill(rows) -> CompactChatLog:
+    log = CompactChatLog()
+    for row in rows:
+        log.add(*row, log.cost(*row))
+    return log
+
+
+def test_cost_of_the_first_message_includes_legend_day_and_head_line():
+    lines = sum(tokens.count(line) + 1 for line in ("  see you", "A = Bob", "[2024-05-02]"))
+    assert CompactChatLog().cost(*ROWS[0]) == lines + tokens.count("09:01 A:")
+
+
+def test_cost_of_a_message_merged_into_the_newer_one_has_no_head_line():
+    log = fill(ROWS[:1])
+    assert log.cost(*ROWS[1]) == tokens.count("  ok then") + 1
+
+
+def test_cost_of_a_new_participant_includes_its_alias():
+    log = fill(ROWS[:2])
+    lines = sum(tokens.count(line) + 1 for line in ("  lunch at noon?", "B = Alice"))
+    assert log.cost(*ROWS[2]) == lines + tokens.count("09:00 B:")
+
+
+def test_length_covers_the_written_log():
+    log = fill(ROWS)
+    assert log.text().split("\n") == [
+        "A = Bob",
+        "B = Alice",
+        "C = Carol",
+        "[2024-05-01]",
+        "17:44 C: is the build fixed",
+        "17:45 B: the build is green",
+        "[2024-05-02]",
+        "09:00 B: lunch at noon?",
+        "09:01 A: ok then",
+        "  see you",
+    ]
+    assert log.length >= tokens.count(log.text())
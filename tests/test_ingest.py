@@ -0,0 +1,159 @@
+import asyncio
+import os
+import threading
+import time
+
+from peewee import OperationalError
+
+import ingest
+import spool
+import store
+from ingest import IngestBuffer
+from spool import Spool
+
+START = "2024-05-06 10:00:00"
+
+
+def message(room_id: str, text: str, seconds: int = 0) -> dict:
+    return {"room_id": room_id, "timestamp": store.to_epoch(START) + seconds, "actor": "Alice", "message": text}
+
+
+def stored(room_id: str) -> list[str]:
+    return [text for _, _, text in store.iter_messages_newest_first(room_id, START)][::-1]
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def failing_fsync(fd):
+    raise OSError(5, "Input/output error")
+
+
+def test_message_whose_spool_sync_failed_is_not_stored(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool, "_RETRY_DELAY", 0.01)
+    buffer = IngestBuffer(100, 50, 100, Spool(str(tmp_path), 1 << 20, 0))
+    buffer.recover()
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+
+    async def offer(text, seconds):
+        return await buffer.offer(message("unsynced", text, seconds))
+
+    assert not asyncio.run(offer("rejected", 0))
+    monkeypatch.setattr(os, "fsync", fsync)
+    assert asyncio.run(offer("accepted", 1))
+    buffer.close()
+    # the sender delivers the rejected message again, it must not be stored twice
+    assert stored("unsynced") == ["accepted"]
+
+
+def flaky_insert(monkeypatch, failures: int) -> list[int]:
+    """Makes the next ``failures`` inserts fail, returns the sizes of all inserts"""
+    insert_messages = store.insert_messages
+    calls = []
+
+    def insert(rows):
+        calls.append(len(rows))
+        if len(calls) <= failures:
+            raise OperationalError("database is locked")
+        insert_messages(rows)
+
+    monkeypatch.setattr(store, "insert_messages", insert)
+    return calls
+
+
+def test_batch_is_stored_again_once_the_database_is_back(monkeypatch):
+    monkeypatch.setattr(ingest, "_RETRY_DELAY", 0.01)
+    calls = flaky_insert(monkeypatch, 2)
+    buffer = IngestBuffer(3, 50, 100)
+    for i in range(3):
+        assert asyncio.run(buffer.offer(message("outage", f"message {i}", i)))
+    wait_for(lambda: stored("outage") == ["message 0", "message 1", "message 2"])
+    buffer.close()
+    # tried as a whole every time, not row by row
+    assert calls == [3, 3, 3]
+
+
+def test_message_that_cannot_be_stored_is_dropped_alone(monkeypatch):
+    insert_messages = store.insert_messages
+
+    def insert(rows):
+        if any(row["message"] == "broken" for row in rows):
+            raise ValueError("broken message")
+        insert_messages(rows)
+
+    monkeypatch.setattr(store, "insert_messages", insert)
+    buffer = IngestBuffer(3, 50, 100)
+    for i, text in enumerate(("before", "broken", "after")):
+        assert asyncio.run(buffer.offer(message("broken", text, i)))
+    buffer.close()
+    assert stored("broken") == ["before", "after"]
+
+
+def test_spool_keeps_the_batch_the_database_did_not_take_before_the_shutdown(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "_RETRY_DELAY", 0.01)
+    buffer = IngestBuffer(100, 10, 100, Spool(str(tmp_path), 1 << 20, 0))
+    buffer.recover()
+    assert asyncio.run(buffer.offer(message("shutdown", "first", 0)))
+    wait_for(lambda: stored("shutdown") == ["first"])
+    flaky_insert(monkeypatch, 1000)
+    assert asyncio.run(buffer.offer(message("shutdown", "second", 1)))
+    buffer.close()
+    monkeypatch.undo()
+
+    next_run = IngestBuffer(100, 10, 100, Spool(str(tmp_path), 1 << 20, 0))
+    next_run.recover()
+    next_run.close()
+    assert stored("shutdown") == ["first", "second"]
+
+
+def test_drain_returns_once_buffered_messages_are_stored():
+    buffer = IngestBuffer(100, 60_000, 100)
+    for i in range(2):
+        assert asyncio.run(buffer.offer(message("drained", f"message {i}", i)))
+    buffer.drain()
+    assert stored("drained") == ["message 0", "message 1"]
+    buffer.close()
+
+
+def test_full_batch_is_flushed_without_waiting_for_the_interval(monkeypatch):
+    calls = flaky_insert(monkeypatch, 0)
+    buffer = IngestBuffer(2, 60_000, 100)
+    for i in range(2):
+        assert asyncio.run(buffer.offer(message("by size", f"message {i}", i)))
+    wait_for(lambda: stored("by size") == ["message 0", "message 1"])
+    buffer.close()
+    assert calls == [2]
+
+
+def test_partial_batch_is_flushed_after_the_interval():
+    buffer = IngestBuffer(100, 50, 100)
+    assert asyncio.run(buffer.offer(message("by interval", "alone")))
+    wait_for(lambda: stored("by interval") == ["alone"])
+    buffer.close()
+
+
+def test_full_buffer_rejects_messages(monkeypatch):
+    insert_messages = store.insert_messages
+    writing, resume = threading.Event(), threading.Event()
+
+    def insert(rows):
+        writing.set()
+        resume.wait()
+        insert_messages(rows)
+
+    monkeypatch.setattr(store, "insert_messages", insert)
+    buffer = IngestBuffer(1, 50, 2)
+    assert asyncio.run(buffer.offer(message("overflow", "written", 0)))
+    wait_for(writing.is_set)
+    for i in (1, 2):
+        assert asyncio.run(buffer.offer(message("overflow", f"buffered {i}", i)))
+    # answered with 503 by the webhook, the sender delivers it again
+    assert not asyncio.run(buffer.offer(message("overflow", "rejected", 3)))
+    resume.set()
+    buffer.close()
+    assert stored("overflow") == ["written", "buffered 1", "buffered 2"]
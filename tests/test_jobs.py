@@ -0,0 +1,75 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+import store
+from jobs import JobInfo, JobRegistry
+
+
+def runner(room_id: str, room_name: str, job_id: str):
+    pass
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(jobs, "REGISTRY", JobRegistry())
+    # jobs get their next run time but never run
+    jobs.scheduler.start(paused=True)
+    yield jobs.scheduler
+    jobs.scheduler.remove_all_jobs()
+    jobs.scheduler.shutdown(wait=False)
+    store.ScheduledJobs.delete().execute()
+
+
+def restart(monkeypatch):
+    jobs.scheduler.remove_all_jobs()
+    monkeypatch.setattr(jobs, "REGISTRY", JobRegistry())
+    jobs.load_jobs(runner)
+
+
+def persist(job_id: str, due: datetime, last_run: datetime | None):
+    store.ScheduledJobs.create(
+        job_id=job_id,
+        room_id="misfire",
+        room_name="Room",
+        hour=due.hour,
+        minute=due.minute,
+        created_at=datetime.now() - timedelta(days=7),
+        last_run=last_run,
+    )
+
+
+def hours_until_next_run(scheduler, job_id: str) -> float:
+    return (scheduler.get_job(job_id).next_run_time.timestamp() - time.time()) / 3600
+
+
+def test_jobs_are_loaded_again_after_a_restart(scheduler, monkeypatch):
+    job_id = jobs.add_job("persisted", "Room", 9, 30, runner)
+    restart(monkeypatch)
+
+    assert jobs.room_jobs("persisted") == [JobInfo(job_id, "persisted", "Room", 9, 30)]
+    assert scheduler.get_job(job_id).args == (runner, "persisted", "Room", job_id)
+
+    jobs.remove_job(job_id)
+    restart(monkeypatch)
+    assert jobs.room_jobs("persisted") == []
+    assert scheduler.get_job(job_id) is None
+
+
+def test_missed_run_is_caught_up_once_within_the_grace_time(scheduler, monkeypatch):
+    monkeypatch.setattr(jobs, "SCHEDULE_JITTER", 0)
+    monkeypatch.setattr(jobs, "SCHEDULE_MISFIRE_GRACE", 3600)
+    now = datetime.now()
+    persist("missed", now - timedelta(minutes=10), now - timedelta(days=1))
+    persist("never run", now - timedelta(minutes=10), None)
+    persist("ran", now - timedelta(minutes=10), now - timedelta(minutes=5))
+    persist("too late", now - timedelta(hours=2), now - timedelta(days=1))
+    restart(monkeypatch)
+
+    assert hours_until_next_run(scheduler, "missed") < 0.01
+    assert hours_until_next_run(scheduler, "never run") < 0.01
+    # the next regular run is tomorrow
+    assert hours_until_next_run(scheduler, "ran") > 12
+    assert hours_until_next_run(scheduler, "too late") > 12
@@ -0,0 +1,58 @@
+import time
+
+import store
+from leader import Leader
+
+
+def test_lease_is_held_by_one_holder_until_it_expires():
+    assert store.acquire_lease("expiry", "a", 0.2)
+    assert not store.acquire_lease("expiry", "b", 0.2)
+    # renewed by its holder
+    assert store.acquire_lease("expiry", "a", 0.2)
+    time.sleep(0.3)
+    assert store.acquire_lease("expiry", "b", 60)
+    assert not store.acquire_lease("expiry", "a", 60)
+
+
+def test_released_lease_is_free_right_away():
+    assert store.acquire_lease("release", "a", 60)
+    # only its holder can release it
+    store.release_lease("release", "b")
+    assert not store.acquire_lease("release", "b", 60)
+    store.release_lease("release", "a")
+    assert store.acquire_lease("release", "b", 60)
+
+
+def test_replica_takes_over_when_the_leader_stops_renewing():
+    first = Leader("takeover", "first", 0.6, enabled=True)
+    second = Leader("takeover", "second", 0.6, enabled=True)
+    first.renew()
+    second.renew()
+    assert first.is_leader
+    assert not second.is_leader
+
+    # the stalled leader steps down before its lease expires
+    time.sleep(0.45)
+    assert not first.is_leader
+    second.renew()
+    assert not second.is_leader
+    time.sleep(0.25)
+    second.renew()
+    assert second.is_leader
+    first.renew()
+    assert not first.is_leader
+
+
+def test_stopped_leader_hands_the_lease_on():
+    first = Leader("handover", "first", 60, enabled=True)
+    second = Leader("handover", "second", 60, enabled=True)
+    first.start()
+    assert first.is_leader
+    first.stop()
+    assert not first.is_leader
+    second.renew()
+    assert second.is_leader
+
+
+def test_only_replica_is_always_the_leader():
+    assert Leader("single", "only", 0.1, enabled=False).is_leader
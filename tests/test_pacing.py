@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+from pacing import INTERACTIVE, SCHEDULED, PriorityLimiter
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    limiter = PriorityLimiter(1, 0, 1)
+    order = []
+
+    async def task(name, priority):
+        async with limiter.slot(priority):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def main():
+        async with limiter.slot(INTERACTIVE):
+            tasks = [
+                asyncio.create_task(task(name, priority))
+                for name, priority in (
+                    ("scheduled 1", SCHEDULED),
+                    ("interactive 1", INTERACTIVE),
+                    ("scheduled 2", SCHEDULED),
+                    ("interactive 2", INTERACTIVE),
+                )
+            ]
+            await asyncio.sleep(0)
+            assert limiter.waiting == 4
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["interactive 1", "interactive 2", "scheduled 1", "scheduled 2"]
+    assert limiter.active == 0
+    assert limiter.waiting == 0
+
+
+def test_cancelled_waiter_does_not_hold_a_slot():
+    limiter = PriorityLimiter(1, 0, 1)
+
+    async def task():
+        async with limiter.slot(INTERACTIVE):
+            pass
+
+    async def main():
+        async with limiter.slot(INTERACTIVE):
+            cancelled = asyncio.create_task(task())
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.gather(cancelled, return_exceptions=True)
+            assert limiter.waiting == 0
+        async with limiter.slot(SCHEDULED):
+            assert limiter.active == 1
+
+    asyncio.run(main())
+    assert limiter.active == 0
+
+
+def test_rate_limited_waiter_is_woken_by_the_timer():
+    # one token every 0.1 seconds, no release happens while the second task waits
+    limiter = PriorityLimiter(0, 600, 1)
+    admitted = []
+
+    async def task():
+        async with limiter.slot(SCHEDULED):
+            admitted.append(time.monotonic())
+
+    async def main():
+        await task()
+        await asyncio.wait_for(task(), 2)
+
+    asyncio.run(main())
+    assert len(admitted) == 2
+    assert admitted[1] - admitted[0] >= 0.09
+    assert limiter._timer is None
@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from spool import Spool
+
+
+def write_segment(directory: str, segment: int, records: list[dict], tail: bytes = b"") -> list[tuple[int, int]]:
+    """Writes a spool segment, returns the position behind every record"""
+    positions = []
+    data = b""
+    for record in records:
+        data += json.dumps(record).encode() + b"\n"
+        positions.append((segment, len(data)))
+    with open(os.path.join(directory, f"{segment:012}.spool"), "wb") as file:
+        file.write(data + tail)
+    return positions
+
+
+def test_replay_skips_a_torn_last_record(tmp_path):
+    positions = write_segment(str(tmp_path), 1, [{"id": 1}, {"id": 2}], tail=b'{"id": 3, "mess')
+
+    replayed = list(Spool(str(tmp_path), 1 << 20, 0).replay(None))
+    assert replayed == [({"id": 1}, positions[0]), ({"id": 2}, positions[1])]
+
+
+def test_replay_skips_an_unreadable_record(tmp_path):
+    directory = str(tmp_path)
+    with open(os.path.join(directory, f"{1:012}.spool"), "wb") as file:
+        file.write(b'{"id": 1}\nnot json\n{"id": 3}\n')
+
+    assert [row for row, _ in Spool(directory, 1 << 20, 0).replay(None)] == [{"id": 1}, {"id": 3}]
+
+
+def test_replay_resumes_behind_a_checkpoint_in_the_middle_of_a_segment(tmp_path):
+    directory = str(tmp_path)
+    write_segment(directory, 1, [{"id": 1}, {"id": 2}])
+    positions = write_segment(directory, 2, [{"id": 3}, {"id": 4}, {"id": 5}])
+    later = write_segment(directory, 3, [{"id": 6}])
+
+    replayed = list(Spool(directory, 1 << 20, 0).replay(positions[0]))
+    assert replayed == [({"id": 4}, positions[1]), ({"id": 5}, positions[2]), ({"id": 6}, later[0])]
+
+
+def test_records_appended_in_one_run_are_replayed_in_the_next(tmp_path):
+    directory = str(tmp_path)
+    spool = Spool(directory, 1 << 20, 0)
+    spool.open(None)
+    positions = [spool.append({"id": i, "message": "äöü"}) for i in range(3)]
+    spool.close()
+
+    next_run = Spool(directory, 1 << 20, 0)
+    assert list(next_run.replay(None)) == [({"id": i, "message": "äöü"}, positions[i]) for i in range(3)]
+    next_run.open(positions[-1])
+    assert next_run.append({"id": 3})[0] > positions[-1][0]
+    next_run.close()
+
+
+def test_full_segment_stays_open_until_it_is_synced(tmp_path, monkeypatch):
+    spool = Spool(str(tmp_path), 1 << 20, 0)
+    old = os.open(tmp_path / "old", os.O_WRONLY | os.O_CREAT)
+    current = os.open(tmp_path / "current", os.O_WRONLY | os.O_CREAT)
+    fsync = os.fsync
+
+    def failing_fsync(fd):
+        if fd == old:
+            raise OSError(5, "Input/output error")
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+    assert isinstance(spool._sync(current, [old]), OSError)
+    # carried over to the next sync and still open
+    assert spool._retired == [old]
+    os.fstat(old)
+
+    monkeypatch.setattr(os, "fsync", fsync)
+    retired, spool._retired = spool._retired, []
+    assert spool._sync(current, retired) is None
+    assert retired == []
+    with pytest.raises(OSError):
+        os.fstat(old)
+    os.close(current)
@@ -0,0 +1,98 @@
+from peewee import DateTimeField, IntegerField, Model, TextField
+
+import store
+
+
+class BaselineMessages(Model):
+    """The message table of the releases before the weekly partitions"""
+
+    id = IntegerField(primary_key=True)
+    timestamp = DateTimeField()
+    room_id = TextField()
+    actor = TextField()
+    message = TextField()
+
+    class Meta:
+        """Meta class for BaselineMessages model"""
+
+        table_name = "chat_messages"
+        indexes = ((("room_id", "timestamp"), False),)
+        database = store.db
+
+
+def insert(room_id: str, *messages: tuple[str, str]):
+    epochs = [store.to_epoch(timestamp) for timestamp, _ in messages]
+    store.create_partitions(epochs)
+    store.insert_messages([
+        {"room_id": room_id, "timestamp": epoch, "actor": "Alice", "message": text}
+        for epoch, (_, text) in zip(epochs, messages, strict=True)
+    ])
+
+
+def tables(since: str, until: str) -> list[str]:
+    return [partition.table for partition in store.partitions(store.to_epoch(since), store.to_epoch(until))]
+
+
+def test_partitions_start_on_monday():
+    for timestamp, monday in (
+        ("2021-03-01 00:00:00", "2021-03-01 00:00:00"),
+        ("2021-03-07 23:59:59", "2021-03-01 00:00:00"),
+        ("2021-03-08 00:00:00", "2021-03-08 00:00:00"),
+        ("2021-03-10 12:30:00", "2021-03-08 00:00:00"),
+    ):
+        assert store.partition_start(store.to_epoch(timestamp)) == store.to_epoch(monday)
+
+
+def test_legacy_messages_move_into_weekly_tables():
+    BaselineMessages.create_table()
+    for timestamp, text in (
+        ("2021-03-07 23:59:59", "sunday release notes"),
+        ("2021-03-08 00:00:00", "monday deployment"),
+        ("2021-03-14 12:00:00", "sunday deployment"),
+    ):
+        BaselineMessages.create(timestamp=timestamp, room_id="legacy", actor="Bob", message=text)
+
+    store.migrate_legacy_messages()
+
+    assert store.LEGACY_TABLE not in store.db.get_tables()
+    assert tables("2021-03-01 00:00:00", "2021-03-15 00:00:00") == ["chat_messages_20210301", "chat_messages_20210308"]
+    first, second = store.partitions(store.to_epoch("2021-03-01 00:00:00"), store.to_epoch("2021-03-15 00:00:00"))
+    assert [row.message for row in first.model.select().where(first.model.room_id == "legacy")] == [
+        "sunday release notes"
+    ]
+    assert second.model.select().where(second.model.room_id == "legacy").count() == 2
+    assert list(store.iter_messages_newest_first("legacy", "2021-03-01 00:00:00")) == [
+        ("2021-03-14 12:00:00", "Bob", "sunday deployment"),
+        ("2021-03-08 00:00:00", "Bob", "monday deployment"),
+        ("2021-03-07 23:59:59", "Bob", "sunday release notes"),
+    ]
+    found = store.search_messages("legacy", ["deployment"], "2021-03-01 00:00:00", 10)
+    assert sorted(text for _, _, text in found) == ["monday deployment", "sunday deployment"]
+
+
+def test_partitions_overlapping_a_range_are_selected():
+    insert(
+        "weeks", ("2019-01-07 10:00:00", "first"), ("2019-01-14 10:00:00", "second"), ("2019-01-21 10:00:00", "third")
+    )
+    assert tables("2019-01-13 23:00:00", "2019-01-14 00:00:01") == ["chat_messages_20190107", "chat_messages_20190114"]
+    # ``until`` is exclusive, ``since`` is inclusive
+    assert tables("2019-01-13 23:00:00", "2019-01-14 00:00:00") == ["chat_messages_20190107"]
+    assert tables("2019-01-20 23:59:59", "2019-01-21 00:00:01") == ["chat_messages_20190114", "chat_messages_20190121"]
+    assert [text for _, _, text in store.iter_messages_newest_first("weeks", "2019-01-13 00:00:00")] == [
+        "third",
+        "second",
+    ]
+
+
+def test_dropped_partition_takes_only_its_week():
+    insert("drop", ("2018-12-30 23:00:00", "old"), ("2018-12-31 01:00:00", "new"))
+    old = store.partitions(store.to_epoch("2018-12-24 00:00:00"), store.to_epoch("2018-12-31 00:00:00"))
+    assert [partition.table for partition in old] == ["chat_messages_20181224"]
+
+    store.drop_partition(old[0])
+
+    assert "chat_messages_20181224" not in store.db.get_tables()
+    assert [text for _, _, text in store.iter_messages_newest_first("drop", "2018-12-01 00:00:00")] == ["new"]
+    # created again for a late message
+    insert("drop", ("2018-12-29 12:00:00", "late"))
+    assert [text for _, _, text in store.iter_messages_newest_first("drop", "2018-12-01 00:00:00")] == ["new", "late"]
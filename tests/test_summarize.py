@@ -0,0 +1,22 @@
+from summarize import format_digest_room, split_digest
+
+
+def test_split_digest():
+    output = "### Room 1\n- first\n\n### Room 2\n- second\n- more\n"
+    assert split_digest(output, 2) == ["- first", "- second\n- more"]
+
+
+def test_split_digest_leaves_out_rooms_the_model_skipped():
+    output = "Here are the summaries.\n## Room 3\n- third\n## Room 1\n- first\n"
+    assert split_digest(output, 3) == ["- first", None, "- third"]
+
+
+def test_split_digest_keeps_the_first_summary_of_a_repeated_room():
+    output = "### Room 1\n- first\n### Room 1\n- again\n### Room 2\n\n### Room 5\n- unknown room\n"
+    assert split_digest(output, 2) == ["- first", None]
+
+
+def test_format_digest_room_escapes_the_name():
+    assert format_digest_room(1, 'Q&A "team" <dev>', "log") == (
+        '<room n="1" name="Q&amp;A &quot;team&quot; &lt;dev&gt;">\nlog\n</room>'
+    )